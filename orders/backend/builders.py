@@ -0,0 +1,90 @@
+"""
+Быстрая сборка ответов только для чтения: строки выбираются через values,
+документ собирается заранее описанными функциями без создания моделей и сериализаторов.
+Формат ответа совпадает с соответствующим сериализатором.
+"""
+from collections import defaultdict
+from operator import itemgetter
+
+from rest_framework import serializers
+
+from backend.models import OrderItem
+
+# поля AccountContactSerializer, доступные для чтения
+CONTACT_FIELDS = ("id", "city", "street", "house", "structure", "building", "floor",
+                  "apartment", "phone")
+# поля OrderSerializer, доступные для чтения, и колонки, из которых они собираются
+ORDER_FIELDS = ("id", "ordered_items", "state", "dt", "total_sum", "item_count", "contact")
+ORDER_FIELD_COLUMNS = {
+    "id": ("id",),
+    "ordered_items": (),
+    "state": ("state",),
+    "dt": ("dt",),
+    "total_sum": ("total_sum",),
+    "item_count": ("item_count",),
+    "contact": ("contact_id", *(f"contact__{field}" for field in CONTACT_FIELDS)),
+}
+ORDER_ITEM_COLUMNS = ("order_id", "id", "product_info_id", "quantity")
+
+# дата в формате DateTimeField из настроек DRF (с учетом часового пояса)
+datetime_field = serializers.DateTimeField()
+
+
+def order_items(order_ids):
+    """Позиции заказов в формате OrderItemSerializer, сгруппированные по заказу"""
+    items = defaultdict(list)
+    for order_id, item_id, product_info_id, quantity in OrderItem.objects.filter(
+        order_id__in=order_ids
+    ).order_by("id").values_list(*ORDER_ITEM_COLUMNS):
+        items[order_id].append({"id": item_id, "product_info": product_info_id,
+                                "quantity": quantity})
+    return items
+
+
+def order_columns(fields=ORDER_FIELDS):
+    """Колонки Order, из которых собираются поля fields (id - всегда)"""
+    columns = ["id"]
+    for field in fields:
+        columns.extend(column for column in ORDER_FIELD_COLUMNS[field] if column not in columns)
+    return columns
+
+
+def build_orders(queryset, fields=ORDER_FIELDS, expressions=None):
+    """
+    Список заказов в формате OrderSerializer (только чтение) - не более двух запросов
+    на любой объем. Выбираются только колонки полей fields, позиции - только при ordered_items.
+    expressions - выражения, которыми вычисляются поля вместо колонок (поле -> выражение).
+    """
+    expressions = {field: expression for field, expression in (expressions or {}).items()
+                   if field in fields}
+    # имя аннотации не может совпадать с полем модели
+    rows = list(queryset.values(
+        *(column for column in order_columns(fields) if column not in expressions),
+        **{f"computed_{field}": expression for field, expression in expressions.items()},
+    ))
+    for row in rows:
+        for field in expressions:
+            row[field] = row.pop(f"computed_{field}")
+    return render_orders(rows, fields)
+
+
+def render_orders(rows, fields=ORDER_FIELDS):
+    """Заказы из уже выбранных строк values (например, страницы) с колонками order_columns"""
+    items = order_items([row["id"] for row in rows]) if "ordered_items" in fields else None
+    to_datetime = datetime_field.to_representation
+    contact_columns = [(field, f"contact__{field}") for field in CONTACT_FIELDS]
+
+    def ordered_items(row):
+        return items[row["id"]]
+
+    def dt(row):
+        return to_datetime(row["dt"]) if row["dt"] is not None else None
+
+    def contact(row):
+        if row["contact_id"] is None:
+            return None
+        return {field: row[column] for field, column in contact_columns}
+
+    special = {"ordered_items": ordered_items, "dt": dt, "contact": contact}
+    getters = [(field, special.get(field) or itemgetter(field)) for field in fields]
+    return [{field: getter(row) for field, getter in getters} for row in rows]
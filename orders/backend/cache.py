@@ -0,0 +1,299 @@
+import hashlib
+import time
+from collections import OrderedDict
+from threading import RLock
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework.response import Response
+
+from backend.models import Category, Parameter
+
+CATALOG_VERSION_KEY = "catalog:version"
+CATALOG_MODIFIED_KEY = "catalog:modified"
+BASKET_VERSION_KEY = "basket:{user_id}:version"
+# версии остатков: по магазину и общая ("all"), меняются при оформлении и отмене заказов
+STOCK_VERSION_KEY = "stock:{scope}:version"
+STOCK_MODIFIED_KEY = "stock:{scope}:modified"
+# кэши, которые не видны другим процессам (веб-серверу и обработчику загрузок)
+PROCESS_LOCAL_CACHES = ("django.core.cache.backends.locmem.LocMemCache",
+                        "django.core.cache.backends.dummy.DummyCache")
+
+
+@checks.register(checks.Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    """Версии каталога, справочников и корзин должны быть видны всем процессам"""
+    backend = settings.CACHES["default"]["BACKEND"]
+    if backend not in PROCESS_LOCAL_CACHES:
+        return []
+    return [checks.Error(
+        f"Кэш {backend} не общий для процессов: после загрузки прайса обработчиком "
+        "веб-сервер не увидит новую версию каталога",
+        hint="Укажите в CACHE_URL общий кэш (redis://, memcache://) или файловый (filecache://)",
+        id="backend.E001",
+    )]
+
+
+class DictionaryCache:
+    """
+    Ограниченный кэш справочника имя <-> id в памяти процесса.
+    Заполняется из БД при первом обращении, вытесняет давно не используемые записи.
+    При изменении справочника (сигналы) меняется версия в общем кэше Django -
+    кэши всех процессов сбрасываются при следующем обращении (версия проверяется
+    не чаще раза в check_interval секунд); кроме того, записи живут не дольше ttl секунд.
+    """
+    def __init__(self, model, max_size=10000, ttl=300, check_interval=1):
+        self.model = model
+        self.max_size = max_size
+        self.ttl = ttl
+        self.check_interval = check_interval
+        self.version_key = f"dictionary:{model._meta.label_lower}:version"
+        self._lock = RLock()
+        self._ids = OrderedDict()
+        self._names = OrderedDict()
+        self._warm = False
+        self._version = None
+        self._loaded = 0
+        self._checked = 0
+
+    def __deepcopy__(self, memo):
+        # кэш общий для процесса, DRF копирует аргументы полей сериализаторов
+        return self
+
+    def _clear(self):
+        self._ids.clear()
+        self._names.clear()
+        self._warm = False
+
+    def _sync(self):
+        # справочник изменен в другом процессе или записи устарели
+        now = time.monotonic()
+        if now - self._checked < self.check_interval:
+            return
+        self._checked = now
+        version = cache.get(self.version_key)
+        if version != self._version or now - self._loaded > self.ttl:
+            self._clear()
+            self._version = version
+            self._loaded = now
+
+    def _warm_up(self):
+        self._sync()
+        if self._warm:
+            return
+        rows = self.model.objects.order_by("id").values_list("id", "name")[:self.max_size]
+        for object_id, name in rows:
+            self._store(object_id, name)
+        self._warm = True
+
+    def _store(self, object_id, name):
+        self._names[object_id] = name
+        self._names.move_to_end(object_id)
+        # при совпадении имен используется запись с меньшим id
+        if self._ids.get(name, object_id) >= object_id:
+            self._ids[name] = object_id
+        self._ids.move_to_end(name)
+        while len(self._names) > self.max_size:
+            self._names.popitem(last=False)
+        while len(self._ids) > self.max_size:
+            self._ids.popitem(last=False)
+
+    def add(self, object_id, name):
+        with self._lock:
+            self._sync()
+            self._store(object_id, name)
+
+    def get_names(self, ids):
+        """Словарь id -> имя, недостающие записи загружаются одним запросом"""
+        with self._lock:
+            self._warm_up()
+            result = {object_id: self._names[object_id] for object_id in ids
+                      if object_id in self._names}
+            for object_id in result:
+                self._names.move_to_end(object_id)
+            missing = set(ids) - result.keys()
+            if missing:
+                for object_id, name in self.model.objects.filter(
+                        id__in=missing).values_list("id", "name"):
+                    self._store(object_id, name)
+                    result[object_id] = name
+            return result
+
+    def get_ids(self, names):
+        """Словарь имя -> id, недостающие записи загружаются одним запросом"""
+        with self._lock:
+            self._warm_up()
+            result = {name: self._ids[name] for name in names if name in self._ids}
+            for name in result:
+                self._ids.move_to_end(name)
+            missing = set(names) - result.keys()
+            if missing:
+                for object_id, name in self.model.objects.filter(
+                        name__in=missing).values_list("id", "name"):
+                    self._store(object_id, name)
+                    result[name] = min(object_id, result.get(name, object_id))
+            return result
+
+    def get_name(self, object_id):
+        return self.get_names([object_id]).get(object_id)
+
+    def get_id(self, name):
+        return self.get_ids([name]).get(name)
+
+    def invalidate(self):
+        """Сброс кэша во всех процессах"""
+        with self._lock:
+            self._clear()
+            self._checked = 0
+            try:
+                cache.incr(self.version_key)
+            except ValueError:
+                cache.set(self.version_key, time.time_ns(), None)
+
+
+category_cache = DictionaryCache(Category)
+parameter_cache = DictionaryCache(Parameter)
+
+
+def get_catalog_version():
+    """Текущая версия каталога (товары, магазины, категории)"""
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        # при потере ключа версия начинается с текущего времени, чтобы не совпасть со старыми ключами
+        cache.add(CATALOG_VERSION_KEY, time.time_ns(), None)
+        version = cache.get(CATALOG_VERSION_KEY, 0)
+    return version
+
+
+def get_catalog_modified():
+    """Время последнего изменения каталога (секунды), для заголовка Last-Modified"""
+    modified = cache.get(CATALOG_MODIFIED_KEY)
+    if modified is None:
+        cache.add(CATALOG_MODIFIED_KEY, int(time.time()), None)
+        modified = cache.get(CATALOG_MODIFIED_KEY, 0)
+    return modified
+
+
+def bump_catalog_version():
+    """Смена версии каталога: все закэшированные страницы становятся недоступны"""
+    try:
+        cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        cache.set(CATALOG_VERSION_KEY, time.time_ns(), None)
+    cache.set(CATALOG_MODIFIED_KEY, int(time.time()), None)
+
+
+def get_stock_version(shop_id=None):
+    """Версия и время изменения (секунды) остатков магазина, без shop_id - всех магазинов"""
+    scope = shop_id if shop_id is not None else "all"
+    keys = (STOCK_VERSION_KEY.format(scope=scope), STOCK_MODIFIED_KEY.format(scope=scope))
+    values = cache.get_many(keys)
+    if len(values) < len(keys):
+        cache.add(keys[0], time.time_ns(), None)
+        cache.add(keys[1], int(time.time()), None)
+        values = cache.get_many(keys)
+    return values.get(keys[0], 0), values.get(keys[1], 0)
+
+
+def bump_stock_versions(shop_ids):
+    """
+    Смена версий остатков магазинов (и общей): страницы с остатками других магазинов,
+    справочники, фасеты и корзины остаются в кэше
+    """
+    modified = int(time.time())
+    for scope in [*shop_ids, "all"]:
+        key = STOCK_VERSION_KEY.format(scope=scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, time.time_ns(), None)
+        cache.set(STOCK_MODIFIED_KEY.format(scope=scope), modified, None)
+
+
+class CatalogCacheMixin:
+    """
+    Кэширование списков каталога с ключом по версии каталога и полному адресу запроса.
+    Страница из кэша отдается без обращения к БД, смена версии делает старые ключи недоступными.
+    Условные запросы (If-None-Match / If-Modified-Since) к неизменившемуся каталогу
+    получают 304 без обращения к кэшу страниц и БД.
+    Страницы с остатками (stock_dependent) учитывают еще и версию остатков -
+    магазина из фильтра shop_id или всех магазинов.
+    """
+    stock_dependent = False
+
+    def stock_scope(self, request):
+        shop_id = request.query_params.get("shop_id") or request.query_params.get("shop__id")
+        return int(shop_id) if shop_id and shop_id.isdigit() else None
+
+    def cached_response(self, request, build):
+        """Ответ из кэша или построенный функцией build (возвращает данные ответа)"""
+        version = get_catalog_version()
+        last_modified = get_catalog_modified()
+        if self.stock_dependent:
+            stock_version, stock_modified = get_stock_version(self.stock_scope(request))
+            version = f"{version}.{stock_version}"
+            last_modified = max(last_modified, stock_modified)
+        # адрес с фильтрами может быть длиннее допустимого ключа memcached
+        uri = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+        # тело ответа зависит и от формата (JSON / Browsable API)
+        etag = quote_etag(hashlib.md5(
+            f"{version}:{uri}:{request.META.get('HTTP_ACCEPT', '')}".encode()
+        ).hexdigest())
+        headers = {"ETag": etag, "Last-Modified": http_date(last_modified), "Vary": "Accept"}
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            for header, value in headers.items():
+                not_modified[header] = value
+            return not_modified
+        key = f"catalog:{version}:{uri}"
+        data = cache.get(key)
+        if data is None:
+            data = build()
+            cache.set(key, data, settings.CATALOG_CACHE_TIMEOUT)
+        return Response(data, headers=headers)
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(
+            request, lambda: super(CatalogCacheMixin, self).list(request, *args, **kwargs).data
+        )
+
+
+def get_basket_version(user_id):
+    """Версия корзины пользователя, меняется при каждой записи в корзину"""
+    key = BASKET_VERSION_KEY.format(user_id=user_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key, 0)
+    return version
+
+
+def bump_basket_version(user_id):
+    key = BASKET_VERSION_KEY.format(user_id=user_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), None)
+
+
+def basket_changed(user_id):
+    """Сброс закэшированной корзины пользователя после фиксации транзакции"""
+    transaction.on_commit(lambda: bump_basket_version(user_id))
+
+
+def cached_basket(user_id, build):
+    """
+    Корзина пользователя из кэша или построенная функцией build.
+    Ключ включает версию корзины и версию каталога (цены в итогах корзины):
+    ответ, собранный до записи, кладется под старый ключ и больше не читается.
+    """
+    key = f"basket:{user_id}:{get_basket_version(user_id)}:{get_catalog_version()}"
+    data = cache.get(key)
+    if data is None:
+        data = build()
+        cache.set(key, data, settings.BASKET_CACHE_TIMEOUT)
+    return data
@@ -0,0 +1,111 @@
+"""
+Карточки товаров: документ позиции в формате ProductInfoSerializer,
+собранный заранее при загрузке прайса. Каталог отдает карточки одним запросом,
+без вложенных сериализаторов и prefetch-запросов.
+"""
+from collections import defaultdict
+
+from django.db.models import F
+from rest_framework.response import Response
+
+from backend.filters import SparseFieldsMixin
+from backend.models import ProductCard, ProductInfo, ProductParameter
+
+CHUNK_SIZE = 1000
+# поля документа в порядке ProductInfoSerializer
+CARD_FIELDS = ("id", "model", "product", "shop", "quantity", "price", "price_rrc",
+               "product_parameters")
+# поля, которые читаются из колонок ProductInfo без карточки
+COLUMNS = {"id": "id", "model": "model", "shop": "shop_id", "quantity": "quantity",
+           "price": "price", "price_rrc": "price_rrc"}
+
+
+def build_documents(ids):
+    """Документы позиций по id: два запроса на любое число позиций"""
+    parameters = defaultdict(list)
+    for product_info_id, name, value in ProductParameter.objects.filter(
+        product_info_id__in=ids
+    ).order_by("id").values_list("product_info_id", "parameter__name", "value"):
+        parameters[product_info_id].append({"parameter": name, "value": value})
+    return {
+        row["id"]: {
+            "id": row["id"],
+            "model": row["model"],
+            "product": {"name": row["product__name"], "category": row["product__category__name"]},
+            "shop": row["shop_id"],
+            "quantity": row["quantity"],
+            "price": row["price"],
+            "price_rrc": row["price_rrc"],
+            "product_parameters": parameters[row["id"]],
+        }
+        for row in ProductInfo.objects.filter(id__in=ids).values(
+            "id", "model", "product__name", "product__category__name", "shop_id",
+            "quantity", "price", "price_rrc",
+        )
+    }
+
+
+def build_cards(ids, chunk_size=CHUNK_SIZE):
+    """Пересборка карточек указанных позиций"""
+    ids = list(ids)
+    for start in range(0, len(ids), chunk_size):
+        documents = build_documents(ids[start:start + chunk_size])
+        ProductCard.objects.bulk_create(
+            [ProductCard(product_info_id=product_info_id, document=document)
+             for product_info_id, document in documents.items()],
+            update_conflicts=True, unique_fields=["product_info"], update_fields=["document"],
+        )
+
+
+def card_documents(rows):
+    """Документы строк, выбранных с аннотацией document; недостающие карточки собираются на лету"""
+    missing = [row.id for row in rows if row.document is None]
+    built = build_documents(missing) if missing else {}
+    return [built[row.id] if row.document is None else row.document for row in rows]
+
+
+class ProductCardMixin(SparseFieldsMixin):
+    """
+    Чтение позиций из карточек: страница выбирается одним запросом,
+    документы отдаются как есть, без сериализатора. Запись идет через serializer_class.
+    Если запрошены (fields= / exclude=) только простые поля, карточка не читается -
+    выбираются только нужные колонки ProductInfo.
+    """
+    sparse_fields = CARD_FIELDS
+
+    def uses_columns(self):
+        return set(self.get_sparse_fields()) <= COLUMNS.keys()
+
+    def select_fields(self, queryset, fields):
+        if self.uses_columns():
+            return queryset.only(*(COLUMNS[field] for field in fields))
+        return queryset.annotate(document=F("card__document")).only("id")
+
+    def render(self, rows):
+        fields = self.get_sparse_fields()
+        if self.uses_columns():
+            columns = [(field, COLUMNS[field]) for field in fields]
+            return [{field: getattr(row, column) for field, column in columns} for row in rows]
+        documents = card_documents(rows)
+        if fields == CARD_FIELDS:
+            return documents
+        return [{field: document[field] for field in fields} for document in documents]
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(self.render(page))
+        return Response(self.render(queryset))
+
+    def retrieve(self, request, *args, **kwargs):
+        return Response(self.render([self.get_object()])[0])
+
+    def batch(self, ids):
+        """Позиции по списку id в порядке запроса и список ненайденных id"""
+        rows = {row.id: row for row in self.get_queryset().filter(id__in=ids)}
+        return Response({
+            "results": self.render([rows[product_info_id] for product_info_id in ids
+                                    if product_info_id in rows]),
+            "missing": [product_info_id for product_info_id in ids if product_info_id not in rows],
+        })
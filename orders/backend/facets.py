@@ -0,0 +1,100 @@
+from collections import defaultdict
+
+from django.db.models import Count, Sum
+
+from backend.cache import parameter_cache
+from backend.models import ParameterFacet, ProductParameter
+
+
+def facet_rows(shop_id):
+    """Счетчики значений параметров магазина в разрезе категорий"""
+    return (
+        ProductParameter.objects.filter(product_info__shop_id=shop_id)
+        .values("product_info__product__category_id", "parameter_id", "value")
+        .annotate(count=Count("id"))
+        .order_by()
+    )
+
+
+def rebuild_shop_facets(shop_id, batch_size=1000):
+    """Пересчет счетчиков значений параметров по магазину"""
+    ParameterFacet.objects.filter(shop_id=shop_id).delete()
+    ParameterFacet.objects.bulk_create(
+        (
+            ParameterFacet(shop_id=shop_id, category_id=row["product_info__product__category_id"],
+                           parameter_id=row["parameter_id"], value=row["value"],
+                           count=row["count"])
+            for row in facet_rows(shop_id).iterator()
+        ),
+        batch_size=batch_size,
+    )
+
+
+def update_shop_facets(shop_id, delta, batch_size=1000):
+    """
+    Изменение счетчиков магазина на delta: {(id категории, id параметра, значение): изменение}.
+    Затрагиваются только счетчики из delta - объем записи зависит от объема изменений прайса.
+    """
+    keys = [key for key, change in delta.items() if change]
+    for start in range(0, len(keys), batch_size):
+        chunk = keys[start:start + batch_size]
+        # выборка по каждому измерению - надмножество нужных счетчиков
+        facets = {
+            (facet.category_id, facet.parameter_id, facet.value): facet
+            for facet in ParameterFacet.objects.filter(
+                shop_id=shop_id,
+                category_id__in={category_id for category_id, _, _ in chunk},
+                parameter_id__in={parameter_id for _, parameter_id, _ in chunk},
+                value__in={value for _, _, value in chunk},
+            )
+        }
+        changed, removed, created = [], [], []
+        for key in chunk:
+            facet = facets.get(key)
+            count = (facet.count if facet else 0) + delta[key]
+            if facet is None:
+                if count > 0:
+                    created.append(ParameterFacet(shop_id=shop_id, category_id=key[0],
+                                                  parameter_id=key[1], value=key[2], count=count))
+            elif count > 0:
+                facet.count = count
+                changed.append(facet)
+            else:
+                removed.append(facet.id)
+        ParameterFacet.objects.bulk_update(changed, ["count"])
+        ParameterFacet.objects.filter(id__in=removed).delete()
+        ParameterFacet.objects.bulk_create(created)
+
+
+def format_facets(rows):
+    names = parameter_cache.get_names({row["parameter_id"] for row in rows})
+    values = defaultdict(list)
+    for row in rows:
+        values[row["parameter_id"]].append({"value": row["value"], "count": row["count"]})
+    return [
+        {
+            "parameter": names.get(parameter_id),
+            "values": sorted(items, key=lambda item: (-item["count"], item["value"])),
+        }
+        for parameter_id, items in sorted(values.items(), key=lambda item: names.get(item[0]) or "")
+    ]
+
+
+def precomputed_facets(shop_id=None, category_id=None):
+    """Счетчики из таблицы ParameterFacet для выборки по магазину и/или категории"""
+    facets = ParameterFacet.objects.all()
+    if shop_id is not None:
+        facets = facets.filter(shop_id=shop_id)
+    if category_id is not None:
+        facets = facets.filter(category_id=category_id)
+    return format_facets(list(
+        facets.values("parameter_id", "value").annotate(count=Sum("count")).order_by()
+    ))
+
+
+def queryset_facets(queryset):
+    """Счетчики значений параметров по произвольной выборке позиций"""
+    return format_facets(list(
+        ProductParameter.objects.filter(product_info_id__in=queryset.order_by().values("id"))
+        .values("parameter_id", "value").annotate(count=Count("id")).order_by()
+    ))
@@ -0,0 +1,97 @@
+import hashlib
+from tempfile import TemporaryFile
+
+from requests import get
+
+CHUNK_SIZE = 64 * 1024
+
+
+class PriceListTooLarge(ValueError):
+    """Размер прайса превышает допустимый"""
+
+
+class Download:
+    """
+    Прайс, полученный от поставщика.
+    stream - файл с содержимым (None, если сервер ответил 304 Not Modified),
+    content_type - тип содержимого по ответу сервера (для выбора формата),
+    etag, last_modified и content_hash сохраняются в магазине для следующих загрузок.
+    """
+    def __init__(self, stream=None, etag="", last_modified="", content_hash="", content_type=""):
+        self.stream = stream
+        self.content_type = content_type
+        self.etag = etag
+        self.last_modified = last_modified
+        self.content_hash = content_hash
+
+    @property
+    def not_modified(self):
+        return self.stream is None
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def hash_chunks(chunks, max_size, target=None):
+    """Подсчет хэша содержимого с контролем размера и, при необходимости, копированием в target"""
+    digest = hashlib.sha256()
+    size = 0
+    for chunk in chunks:
+        size += len(chunk)
+        if size > max_size:
+            raise PriceListTooLarge(f"Размер прайса превышает {max_size} байт")
+        digest.update(chunk)
+        if target is not None:
+            target.write(chunk)
+    return digest.hexdigest()
+
+
+def download_price_list(url, max_size, etag="", last_modified="", timeout=30):
+    """
+    Условная потоковая загрузка прайса по ссылке.
+    Содержимое пишется во временный файл, поэтому в памяти не держится.
+    """
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    with get(url, headers=headers, stream=True, timeout=timeout) as response:
+        if response.status_code == 304:
+            return Download(etag=etag, last_modified=last_modified)
+        response.raise_for_status()
+        length = response.headers.get("Content-Length")
+        if length and length.isdigit() and int(length) > max_size:
+            raise PriceListTooLarge(f"Размер прайса превышает {max_size} байт")
+        stream = TemporaryFile()
+        try:
+            content_hash = hash_chunks(response.iter_content(CHUNK_SIZE), max_size, stream)
+            stream.seek(0)
+        except Exception:
+            stream.close()
+            raise
+        return Download(
+            stream, etag=response.headers.get("ETag", ""),
+            last_modified=response.headers.get("Last-Modified", ""), content_hash=content_hash,
+            content_type=response.headers.get("Content-Type", ""),
+        )
+
+
+def open_price_file(path, max_size):
+    """Открытие прайса из файла с подсчетом хэша содержимого"""
+    stream = open(path, "rb")
+    try:
+        content_hash = hash_chunks(iter(lambda: stream.read(CHUNK_SIZE), b""), max_size)
+        stream.seek(0)
+    except Exception:
+        stream.close()
+        raise
+    return Download(stream, content_hash=content_hash)
+
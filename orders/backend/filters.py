@@ -1,11 +1,119 @@
 from django_filters import rest_framework as filters
-from backend.models import ProductInfo
+from rest_framework.exceptions import ValidationError
+from backend.cache import parameter_cache
+from backend.models import Order, ProductInfo, ProductParameter, STATE_CHOICES
+from backend.search import search_products
+
+
+def parse_ids(value, max_count=None):
+    """Список id из строки "1,2,3" в порядке следования, без повторов"""
+    try:
+        ids = list(dict.fromkeys(int(item) for item in value.split(",") if item.strip()))
+    except ValueError:
+        raise ValidationError({"status": "Failure", "error": "Не корректный список ids"})
+    if max_count is not None and len(ids) > max_count:
+        raise ValidationError({"status": "Failure",
+                               "error": f"Можно запросить не более {max_count} ids"})
+    return ids
+
+
+def parse_fields(params, allowed):
+    """
+    Набор полей ответа по параметрам fields= и exclude= (имена через запятую).
+    Поля возвращаются в порядке allowed; без параметров - все поля.
+    """
+    requested = {}
+    for name in ("fields", "exclude"):
+        value = params.get(name)
+        requested[name] = {item.strip() for item in value.split(",") if item.strip()} \
+            if value else set()
+        unknown = requested[name] - set(allowed)
+        if unknown:
+            raise ValidationError({"status": "Failure",
+                                   "error": f"Неизвестные поля: {', '.join(sorted(unknown))}"})
+    fields = tuple(field for field in allowed
+                   if (not requested["fields"] or field in requested["fields"])
+                   and field not in requested["exclude"])
+    if not fields:
+        raise ValidationError({"status": "Failure", "error": "Не выбрано ни одного поля"})
+    return fields
+
+
+class SparseFieldsMixin:
+    """
+    Выбор полей ответа параметрами fields= / exclude=.
+    Выборка ограничивается нужными колонками (only), набор полей передается
+    сериализатору в контексте.
+    """
+    sparse_fields = ()
+
+    def get_sparse_fields(self):
+        if not hasattr(self, "_sparse_fields"):
+            self._sparse_fields = parse_fields(self.request.query_params, self.sparse_fields)
+        return self._sparse_fields
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.request.method == "GET":
+            queryset = self.select_fields(queryset, self.get_sparse_fields())
+        return queryset
+
+    def select_fields(self, queryset, fields):
+        return queryset.only(*fields)
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context["fields"] = self.get_sparse_fields()
+        return context
+
+
+def parse_parameters(values):
+    """
+    Разбор условий вида "Имя параметра:значение" в словарь id параметра -> значения.
+    Несколько значений одного параметра объединяются через ИЛИ.
+    None - если указан неизвестный параметр.
+    """
+    conditions = {}
+    for condition in values:
+        name, separator, value = condition.partition(":")
+        if separator:
+            conditions.setdefault(name.strip(), set()).add(value.strip())
+    ids = parameter_cache.get_ids(conditions)
+    if len(ids) < len(conditions):
+        return None
+    return {ids[name]: values for name, values in conditions.items()}
 
 
 class ProductFilter(filters.FilterSet):
     shop_id = filters.NumberFilter(field_name="shop__id")
     category_id = filters.NumberFilter(field_name="product__category_id")
+    search = filters.CharFilter(method="filter_search")
+    parameter = filters.CharFilter(method="filter_parameter")
+
+    def filter_search(self, queryset, name, value):
+        return search_products(queryset, value)
+
+    def filter_parameter(self, queryset, name, value):
+        # параметр может повторяться: ?parameter=Цвет:черный&parameter=Встроенная память (Гб):128
+        conditions = parse_parameters(self.data.getlist(name))
+        if conditions is None:
+            return queryset.none()
+        for parameter_id, values in conditions.items():
+            queryset = queryset.filter(id__in=ProductParameter.objects.filter(
+                parameter_id=parameter_id, value__in=values).values("product_info_id"))
+        return queryset
 
     class Meta:
         model = ProductInfo
-        fields = ["shop__id", "product__category_id"]
\ No newline at end of file
+        fields = ["shop__id", "product__category_id"]
+
+
+class OrderFilter(filters.FilterSet):
+    # ?state=new&state=sent, ?dt_after=2024-01-01&dt_before=2024-01-31
+    state = filters.MultipleChoiceFilter(
+        choices=[choice for choice in STATE_CHOICES if choice[0] != "basket"])
+    dt = filters.DateFromToRangeFilter()
+
+    class Meta:
+        model = Order
+        fields = ["state", "dt"]
@@ -0,0 +1,310 @@
+from collections import Counter, defaultdict
+from itertools import islice
+
+from django.db import connection, transaction
+from django.db.models import F
+
+from backend import search
+from backend.cards import build_cards
+from backend.cache import bump_catalog_version, category_cache, parameter_cache
+from backend.facets import rebuild_shop_facets, update_shop_facets
+from backend.models import Shop, Category, Product, ProductInfo, Parameter, ProductParameter,\
+    OrderItem, ProductCard
+from backend.totals import refresh_order_totals, refresh_shop_baskets
+
+
+def chunked(iterable, size):
+    """Разбивка последовательности на списки фиксированного размера"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def delete_product_infos(queryset):
+    """
+    Удаление позиций выборки запросами DELETE ... WHERE ... IN (подзапрос):
+    без выборки строк в память, сигналов post_delete и каскадов Django.
+    Поэтому ссылающиеся на ProductInfo строки удаляются здесь же явно
+    (новую связь с ProductInfo нужно добавить сюда): поисковый индекс (backend.search),
+    ProductCard, ProductParameter и OrderItem. Позиции размещенных заказов
+    должны быть исключены из выборки - удаляются только позиции корзин.
+    Возвращает число удаленных позиций.
+    """
+    ids_sql, params = queryset.values("id").query.sql_with_params()
+    baskets = list(OrderItem.objects.filter(product_info_id__in=queryset.values("id"))
+                   .values_list("order_id", flat=True).distinct())
+    search.remove_products(ids_sql, params)
+    with connection.cursor() as cursor:
+        for model in (ProductCard, ProductParameter, OrderItem):
+            cursor.execute(f"DELETE FROM {model._meta.db_table} "
+                           f"WHERE product_info_id IN ({ids_sql})", params)
+        cursor.execute(f"DELETE FROM {ProductInfo._meta.db_table} WHERE id IN ({ids_sql})",
+                       params)
+        removed = cursor.rowcount
+    refresh_order_totals(baskets)
+    return removed
+
+
+class PriceListImporter:
+    """
+    Загрузка прайса поставщика пакетами.
+    Категории, продукты и параметры сопоставляются через словари имя -> id,
+    информация о продуктах и их параметры пишутся через bulk_create,
+    весь импорт выполняется в одной транзакции.
+    Товары (goods) могут быть ленивым итератором - они читаются порциями по batch_size.
+    В инкрементальном режиме (по умолчанию) прайс сравнивается с текущим по external_id,
+    без инкрементального режима прайс магазина полностью пересоздается
+    (кроме позиций размещенных заказов - они обновляются на месте или снимаются с продажи).
+    """
+    batch_size = 1000
+    product_info_fields = ("product_id", "model", "price", "price_rrc", "quantity")
+
+    def __init__(self, user_id, batch_size=None, incremental=True, progress=None, shop_id=None):
+        self.user_id = user_id
+        # магазин, в который загружается прайс; без него - магазин пользователя
+        self.shop_id = shop_id
+        if batch_size:
+            self.batch_size = batch_size
+        self.incremental = incremental
+        # функция, получающая число обработанных позиций после каждой порции
+        self.progress = progress
+        self.processed = 0
+        self.shop = None
+        self.parameters = {}
+        self.seen = set()
+        # позиции, карточки которых нужно пересобрать
+        self.touched = set()
+        # изменения счетчиков значений параметров: (категория, параметр, значение) -> изменение
+        self.facet_delta = Counter()
+        self.summary = dict.fromkeys(("inserted", "updated", "unchanged", "removed"), 0)
+
+    def run(self, data):
+        with transaction.atomic():
+            self.shop = self.get_shop(data["shop"])
+            merge = self.incremental
+            if not self.incremental:
+                # позиции размещенных заказов остаются и сопоставляются с прайсом по external_id
+                merge = self.clear_shop()
+            for chunk in chunked(data["goods"], self.batch_size):
+                if merge:
+                    self.merge_goods(chunk)
+                else:
+                    self.import_goods(chunk)
+                self.processed += len(chunk)
+                if self.progress:
+                    self.progress(self.processed)
+            if merge:
+                self.retire_missing()
+            # категории пишутся после товаров: потоковые форматы (CSV) собирают их по мере чтения,
+            # внешние ключи проверяются при фиксации транзакции
+            self.import_categories(data["categories"])
+            if self.incremental:
+                update_shop_facets(self.shop.id, self.facet_delta)
+            else:
+                rebuild_shop_facets(self.shop.id)
+            build_cards(self.touched)
+            refresh_shop_baskets(self.shop.id)
+            transaction.on_commit(bump_catalog_version)
+        return self.summary
+
+    def get_shop(self, name):
+        if self.shop_id is not None:
+            return Shop.objects.get(id=self.shop_id)
+        # у пользователя один магазин: название в прайсе может отличаться от сохраненного
+        shop, _ = Shop.objects.get_or_create(user_id=self.user_id, defaults={"name": name})
+        return shop
+
+    def import_categories(self, categories):
+        names = {category["id"]: category["name"] for category in categories}
+        # наличие проверяется по БД: кэш процесса может не знать об удалении в другом процессе
+        existing = set(Category.objects.filter(id__in=names).values_list("id", flat=True))
+        created = Category.objects.bulk_create(
+            [Category(id=category_id, name=name) for category_id, name in names.items()
+             if category_id not in existing],
+            # категорию мог создать параллельный импорт
+            ignore_conflicts=True,
+        )
+        self.register(category_cache, created)
+        through = Category.shops.through
+        through.objects.bulk_create(
+            [through(category_id=category_id, shop_id=self.shop.id) for category_id in names],
+            ignore_conflicts=True,
+        )
+
+    def clear_shop(self):
+        """
+        Удаление позиций магазина перед полной загрузкой, кроме позиций размещенных заказов.
+        Возвращает True, если такие позиции остались.
+        """
+        placed = OrderItem.objects.filter(product_info__shop_id=self.shop.id).exclude(
+            order__state="basket").values("product_info_id")
+        self.summary["removed"] += delete_product_infos(
+            ProductInfo.objects.filter(shop_id=self.shop.id).exclude(id__in=placed)
+        )
+        return ProductInfo.objects.filter(shop_id=self.shop.id).exists()
+
+    def resolve_products(self, goods):
+        keys = {(item["name"], item["category"]) for item in goods}
+        products = {
+            (name, category_id): product_id
+            for name, category_id, product_id in Product.objects.filter(
+                name__in={name for name, _ in keys},
+                category_id__in={category_id for _, category_id in keys},
+            ).values_list("name", "category_id", "id")
+        }
+        created = Product.objects.bulk_create(
+            [Product(name=name, category_id=category_id) for name, category_id in keys
+             if (name, category_id) not in products],
+            batch_size=self.batch_size,
+        )
+        for product in created:
+            products[(product.name, product.category_id)] = product.id
+        return products
+
+    def resolve_parameters(self, goods):
+        names = {name for item in goods for name in item["parameters"]} - self.parameters.keys()
+        if not names:
+            return self.parameters
+        self.parameters.update(parameter_cache.get_ids(names))
+        created = Parameter.objects.bulk_create(
+            [Parameter(name=name) for name in names if name not in self.parameters]
+        )
+        for parameter in created:
+            self.parameters[parameter.name] = parameter.id
+        self.register(parameter_cache, created)
+        return self.parameters
+
+    @staticmethod
+    def register(cache, objects):
+        # bulk_create не отправляет сигналы, новые записи добавляются в кэш после фиксации
+        entries = [(obj.id, obj.name) for obj in objects]
+        if entries:
+            transaction.on_commit(lambda: [cache.add(*entry) for entry in entries])
+
+    def product_info_values(self, item, products):
+        return {
+            "product_id": products[(item["name"], item["category"])],
+            "model": item["model"],
+            "price": item["price"],
+            "price_rrc": item["price_rrc"],
+            "quantity": item["quantity"],
+        }
+
+    def parameter_values(self, item, parameters):
+        return {parameters[name]: str(value) for name, value in item["parameters"].items()}
+
+    def count_facets(self, category_id, values, change):
+        for parameter_id, value in values.items():
+            self.facet_delta[(category_id, parameter_id, value)] += change
+
+    def import_goods(self, goods):
+        self.insert_goods(goods, self.resolve_products(goods), self.resolve_parameters(goods))
+
+    def insert_goods(self, goods, products, parameters):
+        if not goods:
+            return
+        product_infos = ProductInfo.objects.bulk_create(
+            [
+                ProductInfo(external_id=item["id"], shop_id=self.shop.id,
+                            **self.product_info_values(item, products))
+                for item in goods
+            ],
+            batch_size=self.batch_size,
+        )
+        rows = [(product_info, self.parameter_values(item, parameters))
+                for item, product_info in zip(goods, product_infos)]
+        self.write_parameters(rows)
+        for item, (_, values) in zip(goods, rows):
+            self.count_facets(item["category"], values, 1)
+        search.index_products(product_info.id for product_info in product_infos)
+        self.touched.update(product_info.id for product_info in product_infos)
+        self.summary["inserted"] += len(product_infos)
+
+    def write_parameters(self, rows):
+        ProductParameter.objects.bulk_create(
+            [
+                ProductParameter(product_info_id=product_info.id,
+                                 parameter_id=parameter_id, value=value)
+                for product_info, values in rows
+                for parameter_id, value in values.items()
+            ],
+            batch_size=self.batch_size,
+        )
+
+    def merge_goods(self, goods):
+        """
+        Сопоставление товаров с текущим прайсом магазина по external_id.
+        Записываются только новые и изменившиеся позиции.
+        """
+        products = self.resolve_products(goods)
+        parameters = self.resolve_parameters(goods)
+        existing = {
+            product_info.external_id: product_info
+            for product_info in ProductInfo.objects.filter(
+                shop_id=self.shop.id, external_id__in=[item["id"] for item in goods]
+            ).only("id", "external_id", *self.product_info_fields)
+            .annotate(category_id=F("product__category_id"))
+        }
+        current_parameters = defaultdict(dict)
+        for product_info_id, parameter_id, value in ProductParameter.objects.filter(
+            product_info_id__in=[product_info.id for product_info in existing.values()]
+        ).values_list("product_info_id", "parameter_id", "value"):
+            current_parameters[product_info_id][parameter_id] = value
+
+        new_goods, changed, reparametrized = [], [], []
+        for item in goods:
+            self.seen.add(item["id"])
+            product_info = existing.get(item["id"])
+            if product_info is None:
+                new_goods.append(item)
+                continue
+            values = self.product_info_values(item, products)
+            item_parameters = self.parameter_values(item, parameters)
+            fields_changed = any(getattr(product_info, field) != value
+                                 for field, value in values.items())
+            parameters_changed = item_parameters != current_parameters[product_info.id]
+            if fields_changed:
+                for field, value in values.items():
+                    setattr(product_info, field, value)
+                changed.append(product_info)
+            if parameters_changed or product_info.category_id != item["category"]:
+                self.count_facets(product_info.category_id,
+                                  current_parameters[product_info.id], -1)
+                self.count_facets(item["category"], item_parameters, 1)
+            if parameters_changed:
+                reparametrized.append((product_info, item_parameters))
+            if fields_changed or parameters_changed:
+                self.summary["updated"] += 1
+            else:
+                self.summary["unchanged"] += 1
+
+        ProductInfo.objects.bulk_update(changed, self.product_info_fields,
+                                        batch_size=self.batch_size)
+        if reparametrized:
+            ProductParameter.objects.filter(
+                product_info_id__in=[product_info.id for product_info, _ in reparametrized]
+            ).delete()
+            self.write_parameters(reparametrized)
+        updated = ({product_info.id for product_info in changed}
+                   | {product_info.id for product_info, _ in reparametrized})
+        search.index_products(updated)
+        self.touched.update(updated)
+        self.insert_goods(new_goods, products, parameters)
+
+    def retire_missing(self):
+        """
+        Снятие с продажи позиций, отсутствующих в новом прайсе.
+        Строки не удаляются, чтобы не потерять ссылающиеся на них позиции заказов.
+        """
+        missing = [
+            product_info_id for product_info_id, external_id in
+            ProductInfo.objects.filter(shop_id=self.shop.id, quantity__gt=0)
+            .values_list("id", "external_id")
+            if external_id not in self.seen
+        ]
+        for chunk in chunked(missing, self.batch_size):
+            self.summary["removed"] += ProductInfo.objects.filter(id__in=chunk).update(quantity=0)
+        self.touched.update(missing)
@@ -0,0 +1,175 @@
+import os
+from datetime import timedelta
+from threading import Event, Thread
+
+import django
+from django.conf import settings
+from django.db import DatabaseError, connection, connections
+from django.db.models import F, Q
+from django.utils import timezone
+
+from backend.fetch import download_price_list, open_price_file
+from backend.importer import PriceListImporter
+from backend.models import ImportJob, Shop
+from backend.parsers import read_price_list
+
+# интервал отметок о работе задания, секунд
+HEARTBEAT_INTERVAL = 5
+# задание без отметки дольше этого времени считается прерванным
+HEARTBEAT_TIMEOUT = 60
+
+
+def init_worker():
+    # при запуске через spawn процесс начинается с чистого интерпретатора
+    django.setup()
+    # соединения, унаследованные от родительского процесса, не используются
+    connections.close_all()
+
+
+class Heartbeat:
+    """
+    Отметка о работе задания и прогресс загрузки.
+    Пишутся в БД из отдельного потока со своим соединением:
+    импорт идет в одной транзакции основного потока, и его изменения до фиксации не видны.
+    """
+    def __init__(self, job_id, interval=HEARTBEAT_INTERVAL):
+        self.job_id = job_id
+        self.interval = interval
+        self.processed = 0
+        self.read = 0
+        self._stop = Event()
+        self._thread = Thread(target=self._run, name=f"import-job-{job_id}", daemon=True)
+
+    def update(self, processed, read):
+        self.processed = processed
+        self.read = read
+
+    def _run(self):
+        try:
+            while not self._stop.wait(self.interval):
+                try:
+                    ImportJob.objects.filter(id=self.job_id, state="running").update(
+                        heartbeat_at=timezone.now(), processed=self.processed, read=self.read,
+                    )
+                except DatabaseError:
+                    # SQLite блокирует запись на время транзакции импорта
+                    pass
+        finally:
+            connection.close()
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+
+def open_price_list(source, shop=None):
+    """
+    Получение прайса по ссылке (условным запросом) или из файла.
+    Метаданные прошлой загрузки берутся из магазина, если источник не изменился.
+    """
+    if source.startswith(("http://", "https://")):
+        if shop and shop.url == source:
+            return download_price_list(source, settings.IMPORT_MAX_SIZE,
+                                       etag=shop.etag, last_modified=shop.last_modified)
+        return download_price_list(source, settings.IMPORT_MAX_SIZE)
+    return open_price_file(source, settings.IMPORT_MAX_SIZE)
+
+
+def is_unchanged(download, shop):
+    return download.not_modified or bool(
+        shop and shop.content_hash and shop.content_hash == download.content_hash
+    )
+
+
+def save_source(shop_id, source, download):
+    """Сохранение источника и метаданных загруженного прайса в магазине"""
+    fields = {"etag": download.etag, "last_modified": download.last_modified,
+              "content_hash": download.content_hash}
+    if source.startswith(("http://", "https://")):
+        fields["url"] = source
+    else:
+        fields["filename"] = source
+    Shop.objects.filter(id=shop_id).update(**fields)
+
+
+def load_source(importer, source, shop=None, force=False, opened=None):
+    """
+    Загрузка прайса из источника.
+    opened - функция, получающая прайс перед разбором (например, для учета прогресса).
+    Возвращает итоги загрузки или None, если прайс не изменился с прошлой загрузки.
+    """
+    with open_price_list(source, shop) as download:
+        if not force and is_unchanged(download, shop):
+            return None
+        if opened:
+            opened(download)
+        summary = importer.run(read_price_list(download.stream, download.content_type, source))
+    save_source(importer.shop.id, source, download)
+    return summary
+
+
+def claim_job():
+    """Следующее задание из очереди, переведенное в running; None, если очередь пуста"""
+    pending = ImportJob.objects.filter(state="pending").order_by("created_at", "id")
+    for job_id in pending.values_list("id", flat=True)[:10]:
+        now = timezone.now()
+        # условный переход: задание берет только один обработчик
+        if ImportJob.objects.filter(id=job_id, state="pending").update(
+                state="running", started_at=now, heartbeat_at=now):
+            return job_id
+    return None
+
+
+def fail_orphaned_jobs(timeout=HEARTBEAT_TIMEOUT):
+    """Задания, обработчик которых остановлен (нет отметок о работе), помечаются ошибкой"""
+    deadline = timezone.now() - timedelta(seconds=timeout)
+    return ImportJob.objects.filter(
+        Q(heartbeat_at__lt=deadline) | Q(heartbeat_at__isnull=True), state="running",
+    ).update(state="failed", error="Загрузка прервана: обработчик заданий остановлен",
+             finished_at=timezone.now())
+
+
+def run_import_job(job_id):
+    """Выполнение задания, переведенного в running (claim_job), в процессе обработчика"""
+    try:
+        job = ImportJob.objects.get(id=job_id)
+        shop = Shop.objects.filter(user_id=job.user_id).first()
+        importer = PriceListImporter(user_id=job.user_id, incremental=job.incremental)
+        with Heartbeat(job_id) as heartbeat:
+
+            def opened(download):
+                # прогресс в байтах: размер прайса известен до разбора
+                size = os.fstat(download.stream.fileno()).st_size
+                ImportJob.objects.filter(id=job_id).update(size=size)
+                importer.progress = lambda processed: heartbeat.update(
+                    processed, download.stream.tell())
+
+            try:
+                summary = load_source(importer, job.source, shop, opened=opened)
+            except Exception as exc:
+                ImportJob.objects.filter(id=job_id).update(
+                    state="failed", processed=importer.processed,
+                    error=f"{type(exc).__name__}: {exc}", finished_at=timezone.now(),
+                )
+                return
+        if summary is None:
+            ImportJob.objects.filter(id=job_id).update(
+                state="done", shop=shop, summary={"skipped": True}, finished_at=timezone.now(),
+            )
+            return
+        ImportJob.objects.filter(id=job_id).update(
+            state="done", shop=importer.shop, processed=importer.processed,
+            total=importer.processed, read=F("size"), summary=summary,
+            finished_at=timezone.now(),
+        )
+    finally:
+        connection.close()
+
+
+def start_import_job(user, source, incremental=True):
+    """Создание задания на загрузку прайса; выполняет его обработчик run_import_jobs"""
+    return ImportJob.objects.create(user=user, source=source, incremental=incremental)
@@ -0,0 +1,148 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from backend.importer import PriceListImporter
+from backend.jobs import init_worker, load_source
+from backend.models import Shop
+from backend.parsers import EXTENSIONS, PriceListError, read_price_list
+
+
+def import_shop(source, shop_id, incremental=True, force=False):
+    """Загрузка одного прайса в отдельном процессе: своя транзакция и свое соединение с БД"""
+    shop = Shop.objects.get(id=shop_id)
+    importer = PriceListImporter(user_id=shop.user_id, incremental=incremental, shop_id=shop.id)
+    result = {"shop": shop.name, "source": source}
+    started = time.perf_counter()
+    try:
+        summary = load_source(importer, source, shop, force=force)
+        result["status"] = "skipped" if summary is None else "done"
+        result["summary"] = summary
+    except Exception as exc:
+        result["status"] = "failed"
+        result["error"] = f"{type(exc).__name__}: {exc}"
+    finally:
+        connections.close_all()
+    result["seconds"] = time.perf_counter() - started
+    result["rows"] = importer.processed
+    if importer.shop:
+        result["shop"] = importer.shop.name
+    return result
+
+
+class Command(BaseCommand):
+    help = "Параллельная загрузка прайсов магазинов из каталога или по записям Shop (url / filename)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("shops", nargs="*", type=int, help="ID магазинов")
+        parser.add_argument("--all", action="store_true",
+                            help="все магазины с заполненной ссылкой или файлом")
+        parser.add_argument("--dir", help="каталог с файлами прайсов")
+        parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                            help="число процессов (по умолчанию - число ядер)")
+        parser.add_argument("--full", action="store_true",
+                            help="полная перезагрузка вместо инкрементальной")
+        parser.add_argument("--force", action="store_true",
+                            help="загружать даже неизменившиеся прайсы")
+
+    def get_tasks(self, options):
+        tasks = []
+        if options["dir"]:
+            if not os.path.isdir(options["dir"]):
+                raise CommandError(f"Каталог {options['dir']} не найден")
+            shops = Shop.objects.filter(user__isnull=False)
+            for name in sorted(os.listdir(options["dir"])):
+                if os.path.splitext(name)[1].lower() not in EXTENSIONS:
+                    continue
+                path = os.path.join(options["dir"], name)
+                shop = self.match_shop(path, shops)
+                if shop:
+                    tasks.append((path, shop.id))
+        if options["shops"] or options["all"]:
+            shops = Shop.objects.all() if options["all"] else \
+                Shop.objects.filter(id__in=options["shops"])
+            for shop in shops.order_by("id"):
+                source = shop.url or shop.filename
+                if shop.user_id is None:
+                    self.stderr.write(f"У магазина {shop} нет владельца, магазин пропущен")
+                elif source:
+                    tasks.append((source, shop.id))
+                else:
+                    self.stderr.write(f"У магазина {shop} не указан источник прайса")
+        if not tasks:
+            raise CommandError("Не указаны магазины или каталог с прайсами")
+        return tasks
+
+    def match_shop(self, path, shops):
+        """
+        Магазин (с владельцем) для файла из каталога: по файлу последней загрузки,
+        иначе по названию магазина в прайсе. Файлы без однозначного магазина пропускаются -
+        магазин без владельца загрузка не создает.
+        """
+        by_file = [shop for shop in shops.exclude(filename__isnull=True).exclude(filename="")
+                   if os.path.abspath(shop.filename) == os.path.abspath(path)]
+        if len(by_file) == 1:
+            return by_file[0]
+        try:
+            with open(path, "rb") as stream:
+                name = read_price_list(stream, source=path)["shop"]
+        except (OSError, PriceListError, ValueError) as exc:
+            self.stderr.write(f"{path}: прайс не прочитан ({exc}), файл пропущен")
+            return None
+        by_name = list(shops.filter(name=name))
+        if len(by_name) == 1:
+            return by_name[0]
+        if by_name:
+            self.stderr.write(f"{path}: несколько магазинов «{name}», файл пропущен")
+        else:
+            self.stderr.write(f"{path}: магазин «{name}» не найден, файл пропущен")
+        return None
+
+    def handle(self, *args, **options):
+        tasks = self.get_tasks(options)
+        workers = max(1, min(options["workers"], len(tasks)))
+        if workers > 1 and connections["default"].vendor == "sqlite":
+            # SQLite допускает только одну пишущую транзакцию
+            self.stderr.write("SQLite не поддерживает параллельную запись, используется один процесс")
+            workers = 1
+        # процессы-обработчики не должны получить открытые соединения родителя
+        connections.close_all()
+        started = time.perf_counter()
+        results = []
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+            futures = [
+                executor.submit(import_shop, source, shop_id,
+                                incremental=not options["full"], force=options["force"])
+                for source, shop_id in tasks
+            ]
+            for future in as_completed(futures):
+                result = future.result()
+                results.append(result)
+                self.stdout.write(f"{result['status']}: {result['source']}")
+        self.print_table(results, time.perf_counter() - started, workers)
+        if any(result["status"] == "failed" for result in results):
+            raise CommandError("Не все прайсы загружены")
+
+    def print_table(self, results, elapsed, workers):
+        header = ("Магазин", "Статус", "Позиций", "Время, с", "Позиций/с", "Источник")
+        rows = [
+            (
+                result["shop"], result["status"], str(result["rows"]), f"{result['seconds']:.2f}",
+                f"{result['rows'] / result['seconds']:.0f}" if result["seconds"] else "-",
+                result["source"],
+            )
+            for result in sorted(results, key=lambda result: result["seconds"], reverse=True)
+        ]
+        widths = [max(len(row[index]) for row in [header, *rows]) for index in range(len(header))]
+        line = "  ".join("{:<%d}" % width for width in widths)
+        self.stdout.write(line.format(*header))
+        self.stdout.write("  ".join("-" * width for width in widths))
+        for row in rows:
+            self.stdout.write(line.format(*row))
+        for result in results:
+            if result["status"] == "failed":
+                self.stderr.write(f"{result['source']}: {result['error']}")
+        self.stdout.write(f"Всего: {len(results)} прайсов за {elapsed:.2f} с, процессов: {workers}")
@@ -0,0 +1,77 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connections
+
+from backend.jobs import claim_job, fail_orphaned_jobs, init_worker, run_import_job
+
+
+class Command(BaseCommand):
+    help = ("Обработчик заданий на загрузку прайсов: берет задания из очереди (ImportJob) "
+            "и выполняет их в отдельных процессах")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=settings.IMPORT_WORKERS,
+                            help="число процессов (по умолчанию - IMPORT_WORKERS)")
+        parser.add_argument("--poll", type=float, default=2,
+                            help="интервал опроса очереди, секунд")
+        parser.add_argument("--once", action="store_true",
+                            help="выполнить задания из очереди и завершиться")
+
+    sqlite = False
+
+    def sweep(self, running):
+        """
+        Пометка заданий остановленных обработчиков ошибкой.
+        На SQLite - только между заданиями: транзакция импорта блокирует запись в БД,
+        поэтому отметки о работе не пишутся, а сама пометка ждала бы блокировку.
+        """
+        if running and self.sqlite:
+            return
+        try:
+            failed = fail_orphaned_jobs()
+        except DatabaseError as exc:
+            # обработчик не должен останавливаться из-за занятой БД - повтор при следующем опросе
+            self.stderr.write(f"Прерванные задания не проверены: {exc}")
+            return
+        if failed:
+            self.stderr.write(f"Прерванных заданий: {failed}")
+
+    def handle(self, *args, **options):
+        workers = max(1, options["workers"])
+        self.sqlite = connections["default"].vendor == "sqlite"
+        if workers > 1 and self.sqlite:
+            # SQLite допускает только одну пишущую транзакцию
+            self.stderr.write("SQLite не поддерживает параллельную запись, используется один процесс")
+            workers = 1
+        # задания, оставшиеся от остановленного обработчика, не будут завершены
+        self.sweep(running={})
+        # процессы-обработчики не должны получить открытые соединения родителя
+        connections.close_all()
+        running = {}
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+            while True:
+                while len(running) < workers:
+                    job_id = claim_job()
+                    if job_id is None:
+                        break
+                    running[executor.submit(run_import_job, job_id)] = job_id
+                    self.stdout.write(f"Задание {job_id} запущено")
+                if not running:
+                    if options["once"]:
+                        break
+                    connections.close_all()
+                    time.sleep(options["poll"])
+                    self.sweep(running)
+                    continue
+                done, _ = wait(running, timeout=options["poll"], return_when=FIRST_COMPLETED)
+                for future in done:
+                    job_id = running.pop(future)
+                    # ошибки импорта записываются в задание, здесь - только сбой процесса
+                    if future.exception():
+                        self.stderr.write(f"Задание {job_id}: {future.exception()}")
+                    else:
+                        self.stdout.write(f"Задание {job_id} завершено")
+                self.sweep(running)
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.6 on 2026-10-18 09:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0008_importjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shop',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=64, verbose_name='Хэш прайса'),
+        ),
+        migrations.AddField(
+            model_name='shop',
+            name='etag',
+            field=models.CharField(blank=True, max_length=200, verbose_name='ETag прайса'),
+        ),
+        migrations.AddField(
+            model_name='shop',
+            name='last_modified',
+            field=models.CharField(blank=True, max_length=50, verbose_name='Дата изменения прайса'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.6 on 2026-10-18 09:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0009_shop_price_list_metadata'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='shop',
+            name='filename',
+            field=models.CharField(blank=True, max_length=200, null=True, verbose_name='Файл'),
+        ),
+    ]
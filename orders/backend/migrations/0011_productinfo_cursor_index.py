@@ -0,0 +1,17 @@
+# Generated by Django 4.2.6 on 2026-10-18 09:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0010_alter_shop_filename'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='productinfo',
+            index=models.Index(fields=['shop', 'id'], name='product_info_shop_cursor'),
+        ),
+    ]
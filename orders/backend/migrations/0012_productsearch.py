@@ -0,0 +1,48 @@
+from django.db import migrations
+
+SQLITE_FORWARD = [
+    "CREATE VIRTUAL TABLE backend_productsearch USING fts5("
+    "document, tokenize = 'unicode61 remove_diacritics 2')",
+    "INSERT INTO backend_productsearch(rowid, document) "
+    "SELECT pi.id, p.name || ' ' || pi.model || ' ' || COALESCE(group_concat(pp.value, ' '), '') "
+    "FROM backend_productinfo pi JOIN backend_product p ON p.id = pi.product_id "
+    "LEFT JOIN backend_productparameter pp ON pp.product_info_id = pi.id "
+    "GROUP BY pi.id, p.name, pi.model",
+]
+
+POSTGRESQL_FORWARD = [
+    "CREATE TABLE backend_productsearch ("
+    "product_info_id bigint PRIMARY KEY REFERENCES backend_productinfo (id) "
+    "ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+    "document tsvector NOT NULL)",
+    "CREATE INDEX backend_productsearch_document ON backend_productsearch USING GIN (document)",
+    "INSERT INTO backend_productsearch(product_info_id, document) "
+    "SELECT pi.id, to_tsvector('russian', "
+    "p.name || ' ' || pi.model || ' ' || COALESCE(string_agg(pp.value, ' '), '')) "
+    "FROM backend_productinfo pi JOIN backend_product p ON p.id = pi.product_id "
+    "LEFT JOIN backend_productparameter pp ON pp.product_info_id = pi.id "
+    "GROUP BY pi.id, p.name, pi.model",
+]
+
+FORWARD = {"sqlite": SQLITE_FORWARD, "postgresql": POSTGRESQL_FORWARD}
+
+
+def create_search_index(apps, schema_editor):
+    for sql in FORWARD.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor in FORWARD:
+        schema_editor.execute("DROP TABLE IF EXISTS backend_productsearch")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0011_productinfo_cursor_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 4.2.6 on 2026-10-18 09:37
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_facets(apps, schema_editor):
+    ParameterFacet = apps.get_model('backend', 'ParameterFacet')
+    ProductParameter = apps.get_model('backend', 'ProductParameter')
+    rows = (
+        ProductParameter.objects
+        .values('product_info__shop_id', 'product_info__product__category_id', 'parameter_id', 'value')
+        .annotate(count=models.Count('id'))
+        .order_by()
+    )
+    ParameterFacet.objects.bulk_create(
+        (
+            ParameterFacet(shop_id=row['product_info__shop_id'],
+                           category_id=row['product_info__product__category_id'],
+                           parameter_id=row['parameter_id'], value=row['value'], count=row['count'])
+            for row in rows.iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0012_productsearch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ParameterFacet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.CharField(max_length=100, verbose_name='Значение')),
+                ('count', models.PositiveIntegerField(verbose_name='Количество позиций')),
+            ],
+            options={
+                'verbose_name': 'Счетчик значений параметра',
+                'verbose_name_plural': 'Список счетчиков значений параметров',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='productparameter',
+            index=models.Index(fields=['parameter', 'value'], name='product_parameter_value'),
+        ),
+        migrations.AddField(
+            model_name='parameterfacet',
+            name='category',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='parameter_facets', to='backend.category', verbose_name='Категория'),
+        ),
+        migrations.AddField(
+            model_name='parameterfacet',
+            name='parameter',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='facets', to='backend.parameter', verbose_name='Параметр'),
+        ),
+        migrations.AddField(
+            model_name='parameterfacet',
+            name='shop',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='parameter_facets', to='backend.shop', verbose_name='Магазин'),
+        ),
+        migrations.RunPython(fill_facets, migrations.RunPython.noop),
+    ]
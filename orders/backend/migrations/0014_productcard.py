@@ -0,0 +1,54 @@
+# Generated by Django 4.2.6 on 2026-10-18 09:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_cards(apps, schema_editor):
+    ProductCard = apps.get_model('backend', 'ProductCard')
+    ProductInfo = apps.get_model('backend', 'ProductInfo')
+    ProductParameter = apps.get_model('backend', 'ProductParameter')
+    parameters = {}
+    for product_info_id, name, value in ProductParameter.objects.order_by('id').values_list(
+            'product_info_id', 'parameter__name', 'value').iterator():
+        parameters.setdefault(product_info_id, []).append({'parameter': name, 'value': value})
+    ProductCard.objects.bulk_create(
+        (
+            ProductCard(product_info_id=row['id'], document={
+                'id': row['id'],
+                'model': row['model'],
+                'product': {'name': row['product__name'], 'category': row['product__category__name']},
+                'shop': row['shop_id'],
+                'quantity': row['quantity'],
+                'price': row['price'],
+                'price_rrc': row['price_rrc'],
+                'product_parameters': parameters.get(row['id'], []),
+            })
+            for row in ProductInfo.objects.values(
+                'id', 'model', 'product__name', 'product__category__name', 'shop_id',
+                'quantity', 'price', 'price_rrc').iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0013_parameterfacet'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductCard',
+            fields=[
+                ('product_info', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='card', serialize=False, to='backend.productinfo', verbose_name='Информация о продукте')),
+                ('document', models.JSONField(verbose_name='Документ')),
+            ],
+            options={
+                'verbose_name': 'Карточка товара',
+                'verbose_name_plural': 'Список карточек товаров',
+            },
+        ),
+        migrations.RunPython(fill_cards, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.6 on 2026-10-18 09:54
+
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_totals(apps, schema_editor):
+    Order = apps.get_model('backend', 'Order')
+    OrderItem = apps.get_model('backend', 'OrderItem')
+
+    def item_total(expression):
+        return Coalesce(Subquery(
+            OrderItem.objects.filter(order_id=OuterRef('pk')).order_by().values('order_id')
+            .annotate(total=Sum(expression)).values('total')
+        ), Value(0))
+
+    Order.objects.update(
+        total_sum=item_total(F('quantity') * F('product_info__price')),
+        item_count=item_total(F('quantity')),
+    )
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0014_productcard'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Количество товаров'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total_sum',
+            field=models.PositiveIntegerField(default=0, verbose_name='Сумма заказа'),
+        ),
+        migrations.RunPython(fill_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.6 on 2026-10-18 09:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0015_order_totals'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', 'state', 'dt'], name='order_user_state_dt'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.6 on 2026-10-18 10:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0016_order_history_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='read',
+            field=models.PositiveBigIntegerField(default=0, verbose_name='Прочитано, байт'),
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='size',
+            field=models.PositiveBigIntegerField(blank=True, null=True, verbose_name='Размер прайса, байт'),
+        ),
+    ]
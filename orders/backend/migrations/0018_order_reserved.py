@@ -0,0 +1,18 @@
+# Generated by Django 4.2.6 on 2026-10-18 10:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0017_import_job_heartbeat'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='reserved',
+            field=models.BooleanField(default=False, verbose_name='Остатки зарезервированы'),
+        ),
+    ]
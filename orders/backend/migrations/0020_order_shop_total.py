@@ -0,0 +1,50 @@
+# Generated by Django 4.2.6 on 2026-10-18 10:34
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import F, Sum
+
+
+def fill_shop_totals(apps, schema_editor):
+    # цены на момент оформления не сохранялись - уже размещенные заказы считаются по текущим
+    OrderItem = apps.get_model('backend', 'OrderItem')
+    OrderShopTotal = apps.get_model('backend', 'OrderShopTotal')
+    OrderShopTotal.objects.bulk_create(
+        (OrderShopTotal(order_id=row['order_id'], shop_id=row['product_info__shop_id'],
+                        total_sum=row['total_sum'], item_count=row['item_count'])
+         for row in OrderItem.objects.exclude(order__state='basket')
+         .values('order_id', 'product_info__shop_id')
+         .annotate(total_sum=Sum(F('quantity') * F('product_info__price')),
+                   item_count=Sum('quantity'))
+         .order_by().iterator()),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0019_product_info_shop_external'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderShopTotal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_sum', models.PositiveIntegerField(default=0, verbose_name='Сумма по магазину')),
+                ('item_count', models.PositiveIntegerField(default=0, verbose_name='Количество товаров магазина')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shop_totals', to='backend.order', verbose_name='Заказ')),
+                ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='order_totals', to='backend.shop', verbose_name='Магазин')),
+            ],
+            options={
+                'verbose_name': 'Итоги заказа по магазину',
+                'verbose_name_plural': 'Итоги заказов по магазинам',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='ordershoptotal',
+            constraint=models.UniqueConstraint(fields=('shop', 'order'), name='unique_order_shop_total'),
+        ),
+        migrations.RunPython(fill_shop_totals, migrations.RunPython.noop),
+    ]
@@ -15,6 +15,13 @@ STATE_CHOICES = (
     ('canceled', 'Отменен'),
 )
 
+IMPORT_STATE_CHOICES = (
+    ('pending', 'В очереди'),
+    ('running', 'Выполняется'),
+    ('done', 'Завершен'),
+    ('failed', 'Ошибка'),
+)
+
 USER_TYPE_CHOICES = (
     ('shop', 'Магазин'),
     ('buyer', 'Покупатель'),
@@ -107,11 +114,14 @@ class User(AbstractUser):
 class Shop(models.Model):
     name = models.CharField(max_length=50, verbose_name='Название магазина')
     url = models.URLField(verbose_name='Ссылка', null=True, blank=True)
-    filename = models.CharField(max_length=50, verbose_name='Файл', null=True, blank=True)
+    filename = models.CharField(max_length=200, verbose_name='Файл', null=True, blank=True)
     user = models.OneToOneField(User, verbose_name='Пользователь',
                                 blank=True, null=True,
                                 on_delete=models.CASCADE)
     state = models.BooleanField(verbose_name='статус получения заказов', default=False)
+    etag = models.CharField(max_length=200, verbose_name='ETag прайса', blank=True)
+    last_modified = models.CharField(max_length=50, verbose_name='Дата изменения прайса', blank=True)
+    content_hash = models.CharField(max_length=64, verbose_name='Хэш прайса', blank=True)
 
     class Meta:
         verbose_name = 'Магазин'
@@ -172,6 +182,12 @@ class ProductInfo(models.Model):
                 name='unique_product_info'
                 ),
         ]
+        indexes = [
+            # постраничный вывод по курсору с фильтром по магазину
+            models.Index(fields=['shop', 'id'], name='product_info_shop_cursor'),
+            # сопоставление прайса с текущими позициями магазина (инкрементальная загрузка)
+            models.Index(fields=['shop', 'external_id'], name='product_info_shop_external'),
+        ]
 
 
 class Parameter(models.Model):
@@ -202,6 +218,44 @@ class ProductParameter(models.Model):
             models.UniqueConstraint(fields=['product_info', 'parameter'],
                                     name='unique_product_parameter'),
         ]
+        indexes = [
+            # отбор товаров по значению параметра
+            models.Index(fields=['parameter', 'value'], name='product_parameter_value'),
+        ]
+
+
+class ParameterFacet(models.Model):
+    """
+    Число позиций магазина в категории с данным значением параметра.
+    Пересчитывается при загрузке прайса.
+    """
+    shop = models.ForeignKey(Shop, verbose_name='Магазин', related_name='parameter_facets',
+                             on_delete=models.CASCADE)
+    category = models.ForeignKey(Category, verbose_name='Категория', related_name='parameter_facets',
+                                 on_delete=models.CASCADE)
+    parameter = models.ForeignKey(Parameter, verbose_name='Параметр', related_name='facets',
+                                  on_delete=models.CASCADE)
+    value = models.CharField(verbose_name='Значение', max_length=100)
+    count = models.PositiveIntegerField(verbose_name='Количество позиций')
+
+    class Meta:
+        verbose_name = 'Счетчик значений параметра'
+        verbose_name_plural = 'Список счетчиков значений параметров'
+
+
+class ProductCard(models.Model):
+    """
+    Готовый документ позиции для каталога (в формате ProductInfoSerializer).
+    Пересобирается при загрузке прайса и изменении позиции.
+    """
+    product_info = models.OneToOneField(ProductInfo, verbose_name='Информация о продукте',
+                                        related_name='card', primary_key=True,
+                                        on_delete=models.CASCADE)
+    document = models.JSONField(verbose_name='Документ')
+
+    class Meta:
+        verbose_name = 'Карточка товара'
+        verbose_name_plural = 'Список карточек товаров'
 
 
 class Contact(models.Model):
@@ -235,11 +289,21 @@ class Order(models.Model):
     contact = models.ForeignKey(Contact, verbose_name='Контакт',
                                 blank=True, null=True,
                                 on_delete=models.CASCADE)
+    # итоги по позициям заказа, пересчитываются при изменении позиций (backend.totals)
+    total_sum = models.PositiveIntegerField(verbose_name='Сумма заказа', default=0)
+    item_count = models.PositiveIntegerField(verbose_name='Количество товаров', default=0)
+    # остатки списаны при оформлении (backend.reservations); заказы, размещенные
+    # до резервирования, остатков не списывали и при отмене их не возвращают
+    reserved = models.BooleanField(verbose_name='Остатки зарезервированы', default=False)
 
     class Meta:
         verbose_name = 'Заказ'
         verbose_name_plural = 'Список заказов'
         ordering = ('-dt',)
+        indexes = [
+            # история заказов пользователя с фильтром по статусу и дате
+            models.Index(fields=['user', 'state', 'dt'], name='order_user_state_dt'),
+        ]
 
     def __str__(self):
         return str(self.dt)
@@ -262,6 +326,56 @@ class OrderItem(models.Model):
         ]
 
 
+class OrderShopTotal(models.Model):
+    """Итоги размещенного заказа по позициям одного магазина (для поставщика), см. backend.reservations"""
+    order = models.ForeignKey(Order, verbose_name='Заказ', related_name='shop_totals',
+                              on_delete=models.CASCADE)
+    shop = models.ForeignKey(Shop, verbose_name='Магазин', related_name='order_totals',
+                             on_delete=models.CASCADE)
+    total_sum = models.PositiveIntegerField(verbose_name='Сумма по магазину', default=0)
+    item_count = models.PositiveIntegerField(verbose_name='Количество товаров магазина', default=0)
+
+    class Meta:
+        verbose_name = 'Итоги заказа по магазину'
+        verbose_name_plural = 'Итоги заказов по магазинам'
+        constraints = [
+            # заказы поставщика выбираются по магазину
+            models.UniqueConstraint(fields=['shop', 'order'], name='unique_order_shop_total'),
+        ]
+
+
+class ImportJob(models.Model):
+    user = models.ForeignKey(User, verbose_name='Пользователь',
+                             related_name='import_jobs', on_delete=models.CASCADE)
+    shop = models.ForeignKey(Shop, verbose_name='Магазин', related_name='import_jobs',
+                             blank=True, null=True, on_delete=models.SET_NULL)
+    source = models.CharField(max_length=200, verbose_name='Источник прайса')
+    incremental = models.BooleanField(verbose_name='Инкрементальная загрузка', default=True)
+    state = models.CharField(verbose_name='Статус', choices=IMPORT_STATE_CHOICES,
+                             max_length=10, default='pending')
+    processed = models.PositiveIntegerField(verbose_name='Обработано позиций', default=0)
+    total = models.PositiveIntegerField(verbose_name='Всего позиций', blank=True, null=True)
+    # прогресс по байтам: товары читаются потоком, их число известно только в конце
+    size = models.PositiveBigIntegerField(verbose_name='Размер прайса, байт',
+                                          blank=True, null=True)
+    read = models.PositiveBigIntegerField(verbose_name='Прочитано, байт', default=0)
+    summary = models.JSONField(verbose_name='Итоги загрузки', blank=True, null=True)
+    error = models.TextField(verbose_name='Ошибка', blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    # последняя отметка обработчика о работе задания
+    heartbeat_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        verbose_name = 'Загрузка прайса'
+        verbose_name_plural = 'Список загрузок прайсов'
+        ordering = ('-created_at',)
+
+    def __str__(self):
+        return f'{self.source} {self.state}'
+
+
 class ConfirmEmailToken(models.Model):
     class Meta:
         verbose_name = 'Токен подтверждения Email'
@@ -0,0 +1,72 @@
+"""
+Сравнение цен на продукт в разных магазинах.
+Лучшие предложения и сводка по продукту считаются одним запросом с оконными функциями.
+"""
+from django.db.models import F, Min, Sum, Window
+from django.db.models.functions import DenseRank, RowNumber
+
+from backend.models import ProductInfo
+
+OFFER_FIELDS = ("id", "shop_id", "shop__name", "model", "price", "price_rrc", "quantity")
+
+
+def available_offers():
+    """Предложения магазинов, принимающих заказы, с товаром в наличии"""
+    return ProductInfo.objects.filter(shop__state=True, quantity__gt=0)
+
+
+def best_offers(offers, top=3, after=None, limit=40):
+    """
+    Сводка по продуктам из выборки предложений: минимальная цена, число магазинов,
+    общее количество и top лучших предложений (по возрастанию цены).
+    Продукты выводятся по возрастанию id начиная после after, не более limit.
+    Возвращает (список продуктов, есть ли следующая страница).
+    """
+    products = offers.order_by().values("product_id").distinct()
+    if after is not None:
+        products = products.filter(product_id__gt=after)
+    # лишний продукт - признак следующей страницы
+    products = products.order_by("product_id")[:limit + 1]
+    partition = {"partition_by": [F("product_id")]}
+    rows = (
+        # выборка может содержать distinct и ранжирование поиска - берутся только id
+        ProductInfo.objects.filter(id__in=offers.order_by().values("id"), product_id__in=products)
+        .annotate(
+            offer_rank=Window(RowNumber(), order_by=[F("price").asc(), F("id").asc()],
+                              **partition),
+            min_price=Window(Min("price"), **partition),
+            # у магазина может быть несколько предложений продукта, а COUNT(DISTINCT) в окне
+            # не поддерживается: число разных магазинов - сумма рангов по возрастанию
+            # и убыванию shop_id минус один
+            shop_rank=Window(DenseRank(), order_by=F("shop_id").asc(), **partition),
+            shop_rank_desc=Window(DenseRank(), order_by=F("shop_id").desc(), **partition),
+            total_quantity=Window(Sum("quantity"), **partition),
+        )
+        .annotate(shops=F("shop_rank") + F("shop_rank_desc") - 1)
+        .filter(offer_rank__lte=top)
+        .order_by("product_id", "offer_rank")
+        .values("product_id", "product__name", "product__category__name", "min_price", "shops",
+                "total_quantity", *OFFER_FIELDS)
+    )
+    result = []
+    for row in rows:
+        if not result or result[-1]["id"] != row["product_id"]:
+            result.append({
+                "id": row["product_id"],
+                "name": row["product__name"],
+                "category": row["product__category__name"],
+                "min_price": row["min_price"],
+                "shops": row["shops"],
+                "quantity": row["total_quantity"],
+                "offers": [],
+            })
+        result[-1]["offers"].append({
+            "id": row["id"],
+            "shop": row["shop_id"],
+            "shop_name": row["shop__name"],
+            "model": row["model"],
+            "price": row["price"],
+            "price_rrc": row["price_rrc"],
+            "quantity": row["quantity"],
+        })
+    return result[:limit], len(result) > limit
@@ -0,0 +1,25 @@
+from rest_framework.pagination import CursorPagination
+
+
+class ProductCursorPagination(CursorPagination):
+    """
+    Постраничный вывод товаров по курсору (keyset) на первичном ключе.
+    Без COUNT и OFFSET: любая страница выбирается по индексу так же быстро, как первая.
+    """
+    ordering = "id"
+
+    def get_ordering(self, request, queryset, view):
+        # при поиске - по убыванию релевантности
+        if "search_rank" in queryset.query.annotations:
+            return ("-search_rank", "id")
+        return super().get_ordering(request, queryset, view)
+
+
+class OrderCursorPagination(CursorPagination):
+    """
+    История заказов по курсору: от новых к старым, при равной дате - по id.
+    Выбирается только страница, позиции загружаются для заказов страницы.
+    """
+    ordering = ("-dt", "-id")
+    page_size_query_param = "page_size"
+    max_page_size = 100
@@ -0,0 +1,217 @@
+import csv
+import io
+import json
+import os
+from itertools import chain
+from urllib.parse import urlparse
+
+import yaml
+from yaml.composer import Composer
+from yaml.events import MappingEndEvent, MappingStartEvent, SequenceEndEvent, SequenceStartEvent
+
+# C-парсер libyaml, если PyYAML собран с ним
+BaseLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+GOODS_FIELDS = ("id", "category", "model", "name", "price", "price_rrc", "quantity")
+INTEGER_FIELDS = ("id", "category", "price", "price_rrc", "quantity")
+
+# формат -> функция чтения, тип содержимого / расширение файла -> формат
+PARSERS = {}
+CONTENT_TYPES = {}
+EXTENSIONS = {}
+
+
+class PriceListError(ValueError):
+    """Ошибка структуры прайса"""
+
+
+def register_parser(name, content_types=(), extensions=()):
+    """
+    Регистрация формата прайса.
+    Функция чтения принимает бинарный поток и возвращает словарь
+    с ключами shop, categories и goods (итератор по товарам).
+    """
+    def decorator(reader):
+        PARSERS[name] = reader
+        CONTENT_TYPES.update(dict.fromkeys(content_types, name))
+        EXTENSIONS.update(dict.fromkeys(extensions, name))
+        return reader
+    return decorator
+
+
+def get_parser(content_type=None, source=None, default="yaml"):
+    """Выбор формата по типу содержимого, затем по расширению файла или ссылки"""
+    if content_type:
+        name = CONTENT_TYPES.get(content_type.split(";")[0].strip().lower())
+        if name:
+            return PARSERS[name]
+    if source:
+        path = urlparse(source).path if "://" in source else source
+        name = EXTENSIONS.get(os.path.splitext(path)[1].lower())
+        if name:
+            return PARSERS[name]
+    return PARSERS[default]
+
+
+def read_price_list(stream, content_type=None, source=None):
+    """Чтение прайса в формате, определенном по типу содержимого или имени источника"""
+    return get_parser(content_type, source)(stream)
+
+
+class StreamLoader(BaseLoader, Composer):
+    """
+    Загрузчик, строящий документ по одному узлу.
+    Позволяет разбирать элементы списков по мере чтения потока.
+    """
+    def __init__(self, stream):
+        BaseLoader.__init__(self, stream)
+        Composer.__init__(self)
+
+    def construct_next(self):
+        return self.construct_document(self.compose_node(None, None))
+
+
+def iter_yaml_price_list(stream):
+    """
+    Потоковый разбор прайса в формате YAML.
+    Отдает пары (раздел, значение): для списков (categories, goods) -
+    по одной паре на каждый элемент, для остальных разделов - одну пару.
+    """
+    loader = StreamLoader(stream)
+    try:
+        # начало потока и документа
+        loader.get_event()
+        loader.get_event()
+        if not loader.check_event(MappingStartEvent):
+            raise PriceListError("Прайс должен быть словарем")
+        loader.get_event()
+        while not loader.check_event(MappingEndEvent):
+            section = loader.construct_next()
+            if loader.check_event(SequenceStartEvent):
+                loader.get_event()
+                while not loader.check_event(SequenceEndEvent):
+                    yield section, loader.construct_next()
+                loader.get_event()
+            else:
+                yield section, loader.construct_next()
+    finally:
+        loader.dispose()
+
+
+@register_parser("yaml", content_types=("application/yaml", "application/x-yaml", "text/yaml",
+                                        "text/x-yaml"), extensions=(".yaml", ".yml"))
+def read_yaml_price_list(stream):
+    """
+    Чтение прайса YAML: разделы до goods читаются сразу,
+    goods - ленивый итератор по товарам в порядке следования в потоке.
+    Разделы после goods (например, categories) дописываются в словарь
+    по мере чтения товаров - импорт читает категории после товаров.
+    Магазин (shop) должен быть указан до списка товаров.
+    """
+    records = iter_yaml_price_list(stream)
+    data = {"categories": [], "goods": iter(())}
+
+    def store(section, value):
+        if section == "categories":
+            data["categories"].append(value)
+        else:
+            data[section] = value
+
+    def goods(first):
+        yield first
+        for section, value in records:
+            if section == "goods":
+                yield value
+            else:
+                store(section, value)
+
+    for section, value in records:
+        if section == "goods":
+            if "shop" not in data:
+                raise PriceListError("В прайсе не указан магазин перед списком товаров")
+            data["goods"] = goods(value)
+            break
+        store(section, value)
+    if "shop" not in data:
+        raise PriceListError("В прайсе не указан магазин")
+    return data
+
+
+@register_parser("jsonl", content_types=("application/jsonl", "application/x-ndjson",
+                                         "application/x-jsonlines"),
+                 extensions=(".jsonl", ".ndjson"))
+def read_jsonl_price_list(stream):
+    """
+    Чтение прайса JSON Lines: первая строка - {"shop": ..., "categories": [...]},
+    каждая следующая непустая строка - товар в том же виде, что и в YAML.
+    """
+    lines = ((number, line) for number, line in enumerate(stream, start=1) if line.strip())
+    try:
+        header = parse_json_line(*next(lines))
+    except StopIteration:
+        raise PriceListError("Пустой прайс")
+    if "shop" not in header:
+        raise PriceListError("Первая строка прайса должна содержать магазин")
+    return {
+        "shop": header["shop"],
+        "categories": header.get("categories", []),
+        "goods": (parse_json_line(number, line) for number, line in lines),
+    }
+
+
+def parse_json_line(number, line):
+    try:
+        value = json.loads(line)
+    except ValueError:
+        raise PriceListError(f"Строка {number}: не корректный JSON")
+    if not isinstance(value, dict):
+        raise PriceListError(f"Строка {number}: ожидается объект JSON")
+    return value
+
+
+@register_parser("csv", content_types=("text/csv", "application/csv"), extensions=(".csv",))
+def read_csv_price_list(stream):
+    """
+    Чтение прайса CSV (UTF-8, разделитель - запятая).
+    Колонки: shop (достаточно заполнить в первой строке), category, category_name,
+    id, model, name, price, price_rrc, quantity; остальные колонки - параметры товара,
+    пустые значения параметров пропускаются.
+    Категории собираются по мере чтения товаров.
+    """
+    reader = csv.reader(io.TextIOWrapper(stream, encoding="utf-8-sig", newline=""))
+    header = next(reader, None)
+    required = {"shop", "category_name", *GOODS_FIELDS}
+    if header is None or not required <= set(header):
+        raise PriceListError(f"В прайсе должны быть колонки: {', '.join(sorted(required))}")
+    columns = {name: index for index, name in enumerate(header)}
+    parameters = [(index, name) for index, name in enumerate(header) if name not in required]
+    first = next(reader, None)
+    if first is None or len(first) <= columns["shop"] or not first[columns["shop"]]:
+        raise PriceListError("В первой строке прайса не указан магазин")
+    data = {"shop": first[columns["shop"]], "categories": []}
+    seen_categories = set()
+
+    def goods():
+        for row in chain([first], reader):
+            if not row:
+                continue
+            if len(row) < len(header):
+                raise PriceListError(f"Строка {reader.line_num}: колонок {len(row)}, "
+                                     f"ожидается {len(header)}")
+            item = {field: row[columns[field]] for field in GOODS_FIELDS}
+            for field in INTEGER_FIELDS:
+                try:
+                    item[field] = int(item[field])
+                except ValueError:
+                    raise PriceListError(f"Строка {reader.line_num}: значение {field} "
+                                         f"должно быть целым числом")
+            item["parameters"] = {name: row[index] for index, name in parameters if row[index]}
+            if item["category"] not in seen_categories:
+                seen_categories.add(item["category"])
+                data["categories"].append({"id": item["category"],
+                                           "name": row[columns["category_name"]]})
+            yield item
+
+    data["goods"] = goods()
+    return data
@@ -3,7 +3,8 @@ from rest_framework import permissions
 
 class UserIsOwner(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
-        return obj.user == request.user
+        # сравнение по id, без загрузки владельца объекта
+        return obj.user_id == request.user.id
     
 class UserIsShop(permissions.BasePermission):
     def has_permission(self, request, view):
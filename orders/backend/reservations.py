@@ -0,0 +1,112 @@
+"""
+Резервирование остатков при подтверждении заказа и возврат при отмене.
+Строки ProductInfo блокируются в порядке id (одинаковом для всех транзакций,
+поэтому взаимных блокировок нет), остатки всех позиций меняются одним условным UPDATE.
+"""
+from collections import defaultdict
+from functools import partial
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+
+from backend.cache import basket_changed, bump_stock_versions
+from backend.cards import build_cards
+from backend.models import Order, OrderItem, OrderShopTotal, ProductInfo
+
+# статусы, в которых товар заказа зарезервирован
+RESERVED_STATES = ("new", "confirmed", "assembled")
+
+
+class ReservationError(Exception):
+    """Заказ нельзя разместить или отменить"""
+
+
+def order_quantities(order_id):
+    """Количество по позициям заказа: id ProductInfo -> количество"""
+    return dict(OrderItem.objects.filter(order_id=order_id).values_list("product_info_id", "quantity"))
+
+
+def lock_stock(ids):
+    """Блокировка строк остатков в порядке id, возвращает текущие остатки"""
+    return dict(
+        ProductInfo.objects.select_for_update().filter(id__in=ids).order_by("id")
+        .values_list("id", "quantity")
+    )
+
+
+def change_stock(quantities, sign):
+    """
+    Изменение остатков всех позиций одним запросом.
+    При списании строка меняется, только если остатка хватает; возвращает число измененных строк.
+    """
+    delta = Case(*(When(id=product_info_id, then=Value(quantity))
+                   for product_info_id, quantity in quantities.items()),
+                 output_field=IntegerField())
+    queryset = ProductInfo.objects.filter(id__in=quantities)
+    if sign < 0:
+        return queryset.filter(quantity__gte=delta).update(quantity=F("quantity") - delta)
+    return queryset.update(quantity=F("quantity") + delta)
+
+
+def stock_changed(ids):
+    """Пересборка карточек и смена версий остатков только затронутых магазинов"""
+    build_cards(ids)
+    bump_stock_versions(
+        ProductInfo.objects.filter(id__in=ids).order_by().values_list("shop_id", flat=True).distinct()
+    )
+
+
+def place_order(order, contact):
+    """Перевод корзины в новый заказ со списанием остатков; при нехватке ничего не меняется"""
+    with transaction.atomic():
+        lines = OrderItem.objects.filter(order_id=order.id).values_list(
+            "product_info_id", "quantity", "product_info__price", "product_info__shop_id")
+        quantities = {}
+        shop_totals = defaultdict(lambda: [0, 0])
+        for product_info_id, quantity, price, shop_id in lines:
+            quantities[product_info_id] = quantity
+            shop_totals[shop_id][0] += quantity * price
+            shop_totals[shop_id][1] += quantity
+        # сумма заказа фиксируется по ценам на момент оформления, в целом и по магазинам
+        order.total_sum = sum(total_sum for total_sum, _ in shop_totals.values())
+        order.item_count = sum(quantities.values())
+        # условный переход защищает от повторного подтверждения той же корзины
+        if not Order.objects.filter(id=order.id, state="basket").update(
+                state="new", contact=contact, reserved=True,
+                total_sum=order.total_sum, item_count=order.item_count):
+            raise ReservationError("Не корректный статус заказа")
+        if quantities:
+            stock = lock_stock(quantities)
+            if any(stock.get(product_info_id, 0) < quantity
+                   for product_info_id, quantity in quantities.items()) \
+                    or change_stock(quantities, -1) != len(quantities):
+                raise ReservationError("В наличии не достаточно продуктов для оформления заказа")
+            transaction.on_commit(partial(stock_changed, list(quantities)))
+        OrderShopTotal.objects.bulk_create(
+            OrderShopTotal(order_id=order.id, shop_id=shop_id, total_sum=total_sum,
+                           item_count=item_count)
+            for shop_id, (total_sum, item_count) in shop_totals.items()
+        )
+        basket_changed(order.user_id)
+    order.state = "new"
+    order.contact = contact
+    order.reserved = True
+    return order
+
+
+def cancel_order(order):
+    """Отмена заказа с возвратом зарезервированных остатков"""
+    with transaction.atomic():
+        orders = Order.objects.filter(id=order.id, state__in=RESERVED_STATES)
+        # остатки возвращаются, только если заказ их списывал
+        reserved = bool(orders.filter(reserved=True).update(state="canceled", reserved=False))
+        if not reserved and not orders.update(state="canceled"):
+            raise ReservationError("Заказ нельзя отменить")
+        quantities = order_quantities(order.id) if reserved else {}
+        if quantities:
+            lock_stock(quantities)
+            change_stock(quantities, 1)
+            transaction.on_commit(partial(stock_changed, list(quantities)))
+    order.state = "canceled"
+    order.reserved = False
+    return order
@@ -0,0 +1,101 @@
+"""
+Полнотекстовый поиск по товарам: название продукта, модель и значения параметров.
+На SQLite - виртуальная таблица FTS5, на PostgreSQL - таблица с tsvector и GIN-индексом
+(создаются миграцией 0012_productsearch). Индекс обновляется при загрузке прайса.
+"""
+import re
+
+from django.db import connections
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+SEARCH_TABLE = "backend_productsearch"
+SEARCH_CONFIG = "russian"
+TOKEN_RE = re.compile(r"\w+")
+CHUNK_SIZE = 500
+
+DOCUMENT_SQL = {
+    "sqlite": (
+        f"INSERT INTO {SEARCH_TABLE}(rowid, document) "
+        "SELECT pi.id, p.name || ' ' || pi.model || ' ' || COALESCE(group_concat(pp.value, ' '), '') "
+        "FROM backend_productinfo pi JOIN backend_product p ON p.id = pi.product_id "
+        "LEFT JOIN backend_productparameter pp ON pp.product_info_id = pi.id "
+        "WHERE pi.id IN ({ids}) GROUP BY pi.id, p.name, pi.model"
+    ),
+    "postgresql": (
+        f"INSERT INTO {SEARCH_TABLE}(product_info_id, document) "
+        f"SELECT pi.id, to_tsvector('{SEARCH_CONFIG}', "
+        "p.name || ' ' || pi.model || ' ' || COALESCE(string_agg(pp.value, ' '), '')) "
+        "FROM backend_productinfo pi JOIN backend_product p ON p.id = pi.product_id "
+        "LEFT JOIN backend_productparameter pp ON pp.product_info_id = pi.id "
+        "WHERE pi.id IN ({ids}) GROUP BY pi.id, p.name, pi.model"
+    ),
+}
+KEY_COLUMN = {"sqlite": "rowid", "postgresql": "product_info_id"}
+
+
+def index_products(ids, using="default"):
+    """Пересчет поисковых документов для указанных позиций"""
+    connection = connections[using]
+    if connection.vendor not in DOCUMENT_SQL:
+        return
+    ids = list(ids)
+    key = KEY_COLUMN[connection.vendor]
+    with connection.cursor() as cursor:
+        for start in range(0, len(ids), CHUNK_SIZE):
+            chunk = ids[start:start + CHUNK_SIZE]
+            placeholders = ", ".join(["%s"] * len(chunk))
+            cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE {key} IN ({placeholders})", chunk)
+            cursor.execute(DOCUMENT_SQL[connection.vendor].format(ids=placeholders), chunk)
+
+
+def remove_products(ids_sql, params, using="default"):
+    """Удаление из индекса позиций, id которых выбирает подзапрос ids_sql"""
+    connection = connections[using]
+    if connection.vendor not in KEY_COLUMN:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {SEARCH_TABLE} WHERE {KEY_COLUMN[connection.vendor]} IN ({ids_sql})",
+            params,
+        )
+
+
+def search_products(queryset, query):
+    """
+    Отбор позиций по поисковому запросу (все слова запроса должны встретиться).
+    Результат аннотирован релевантностью search_rank: чем больше, тем выше в выдаче.
+    """
+    terms = TOKEN_RE.findall(query.lower())
+    if not terms:
+        return queryset.none()
+    vendor = connections[queryset.db].vendor
+    if vendor == "sqlite":
+        match = " ".join(f'"{term}"' for term in terms)
+        ids = RawSQL(f"SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s", [match])
+        rank = RawSQL(
+            f"SELECT -bm25({SEARCH_TABLE}) FROM {SEARCH_TABLE} "
+            f"WHERE {SEARCH_TABLE} MATCH %s AND rowid = backend_productinfo.id",
+            [match], output_field=FloatField(),
+        )
+    elif vendor == "postgresql":
+        match = " ".join(terms)
+        ids = RawSQL(
+            f"SELECT product_info_id FROM {SEARCH_TABLE} "
+            f"WHERE document @@ plainto_tsquery('{SEARCH_CONFIG}', %s)", [match],
+        )
+        rank = RawSQL(
+            f"SELECT ts_rank(document, plainto_tsquery('{SEARCH_CONFIG}', %s)) FROM {SEARCH_TABLE} "
+            "WHERE product_info_id = backend_productinfo.id",
+            [match], output_field=FloatField(),
+        )
+    else:
+        # прочие СУБД - без индекса и ранжирования
+        condition = Q()
+        for term in terms:
+            condition &= (Q(product__name__icontains=term) | Q(model__icontains=term)
+                          | Q(product_parameters__value__icontains=term))
+        return queryset.filter(condition).distinct().annotate(
+            search_rank=Value(0.0, output_field=FloatField())
+        )
+    return queryset.filter(id__in=ids).annotate(search_rank=rank).order_by("-search_rank", "id")
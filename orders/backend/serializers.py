@@ -1,10 +1,15 @@
+import os
+
 from django.contrib.auth import authenticate
 from django.contrib.auth.password_validation import validate_password
 from django.db.models import Q
+from django.utils import timezone
 from rest_framework import serializers
 
+from backend.cache import basket_changed, category_cache, parameter_cache
 from backend.models import User, ConfirmEmailToken, Contact, Shop, Category, Product, ProductInfo,\
-    ProductParameter, Order, OrderItem
+    ProductParameter, Order, OrderItem, ImportJob
+from backend.totals import refresh_order_totals
 
 class NewAccountSerializer(serializers.ModelSerializer):
     password_confirmation = serializers.CharField(write_only=True, required=True)
@@ -105,8 +110,35 @@ class AccountSerializer(serializers.ModelSerializer):
 
 class PartnerUpdateSerializer(serializers.Serializer):
     url = serializers.URLField(write_only=True, required=True)
+    incremental = serializers.BooleanField(write_only=True, default=True)
+
+
+class PartnerUpdateFileSerializer(serializers.Serializer):
+    filename = serializers.CharField(max_length=40, write_only=True, default="shop.yaml")
+    incremental = serializers.BooleanField(write_only=True, default=True)
+
+    def validate_filename(self, value):
+        # загрузка только из каталога data
+        if os.path.basename(value) != value or not os.path.isfile(os.path.join("./data", value)):
+            raise serializers.ValidationError("Файл прайса не найден")
+        return value
     
 
+class ImportJobSerializer(serializers.ModelSerializer):
+    duration = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ImportJob
+        fields = ('id', 'shop', 'source', 'state', 'processed', 'total', 'size', 'read',
+                  'duration', 'summary', 'error', 'created_at', 'started_at', 'finished_at',)
+        read_only_fields = fields
+
+    def get_duration(self, obj):
+        if not obj.started_at:
+            return None
+        return ((obj.finished_at or timezone.now()) - obj.started_at).total_seconds()
+
+
 class PartnerStateSerialiser(serializers.ModelSerializer):
     name = serializers.CharField(max_length=50, required=False)
     url = serializers.URLField(required=False)
@@ -119,21 +151,42 @@ class PartnerStateSerialiser(serializers.ModelSerializer):
         read_only_fields = ("id",)
         
         
-class CategorySerializer(serializers.ModelSerializer):
+class SparseFieldsSerializer(serializers.ModelSerializer):
+    """Сериализатор, выводящий только поля из context["fields"] (см. SparseFieldsMixin)"""
+    def get_fields(self):
+        fields = super().get_fields()
+        selected = self.context.get("fields")
+        if selected is None:
+            return fields
+        return {name: field for name, field in fields.items() if name in selected}
+
+
+class CategorySerializer(SparseFieldsSerializer):
     class Meta:
         model = Category
         fields = ('id', 'name',)
         read_only_fields = ('id',)
 
 
-class ShopSerializer(serializers.ModelSerializer):
+class ShopSerializer(SparseFieldsSerializer):
     class Meta:
         model = Shop
         fields = ('id', 'name', 'state',)
         read_only_fields = ('id',)
 
+class CachedNameField(serializers.Field):
+    """Имя записи справочника по id из кэша, без обращения к связанной модели"""
+    def __init__(self, cache, **kwargs):
+        self.cache = cache
+        kwargs["read_only"] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        return self.cache.get_name(value)
+
+
 class ProductSerializer(serializers.ModelSerializer):
-    category = serializers.StringRelatedField()
+    category = CachedNameField(category_cache, source='category_id')
 
     class Meta:
         model = Product
@@ -141,7 +194,7 @@ class ProductSerializer(serializers.ModelSerializer):
 
 
 class ProductParameterSerializer(serializers.ModelSerializer):
-    parameter = serializers.StringRelatedField()
+    parameter = CachedNameField(parameter_cache, source='parameter_id')
 
     class Meta:
         model = ProductParameter
@@ -168,30 +221,47 @@ class OrderItemSerializer(serializers.ModelSerializer):
         }
 
 
+class BasketItemSerializer(serializers.Serializer):
+    """
+    Позиция корзины для записи. product_info - id без загрузки объекта:
+    наличие всех позиций проверяется одним запросом в OrderSerializer.validate
+    """
+    product_info = serializers.IntegerField()
+    quantity = serializers.IntegerField(default=1)
+
+
 class OrderSerializer(serializers.ModelSerializer):
     ordered_items = OrderItemSerializer(read_only=True, many=True)
-    items = OrderItemSerializer(write_only=True, many=True)
+    items = BasketItemSerializer(write_only=True, many=True)
     total_sum = serializers.IntegerField(read_only=True)
+    item_count = serializers.IntegerField(read_only=True)
     contact = AccountContactSerializer(read_only=True)
     state = serializers.CharField(required=False)
 
     class Meta:
         model = Order
-        fields = ('id', 'ordered_items', 'state', 'dt', 'total_sum', 'contact', 'items')
+        fields = ('id', 'ordered_items', 'state', 'dt', 'total_sum', 'item_count', 'contact',
+                  'items')
         read_only_fields = ('id',)
         
     def validate(self, data):
         items = data["items"]
+        # при повторе позиции действует последнее количество
+        data["items"] = list({item["product_info"]: item for item in items}.values())
+        stock = dict(
+            ProductInfo.objects.filter(
+                id__in=[item["product_info"] for item in data["items"]]
+            ).values_list("id", "quantity")
+        )
         for item in items:
             product_info = item.get("product_info")
             quantity = item.get("quantity")
 
-            product = ProductInfo.objects.filter(id=product_info.id).first()
-            if not product:
+            if product_info not in stock:
                 raise serializers.ValidationError(
                     {"status": "Failure", "error": "Нет такого продукта"}
                 )
-            if quantity > product.quantity:
+            if quantity > stock[product_info]:
                 raise serializers.ValidationError(
                     {"status": "Failure",
                      "error": "В наличии не достаточно продуктов для добавления в корзину"}
@@ -207,12 +277,19 @@ class OrderSerializer(serializers.ModelSerializer):
         items = validated_data.pop("items")
 
         order, _ = Order.objects.get_or_create(**validated_data, user_id=user.id, state="basket")
-        for item in items:
-            product_id = item.get("product_info")
-            quantity = item.get("quantity", 1)
-            OrderItem.objects.update_or_create(
-                order=order, product_info=product_id, defaults={"quantity": quantity}
-            )
+        # вставка или обновление количества всех позиций одним запросом (unique_order_item)
+        OrderItem.objects.bulk_create(
+            [
+                OrderItem(order=order, product_info_id=item["product_info"],
+                          quantity=item["quantity"])
+                for item in items
+            ],
+            update_conflicts=True,
+            unique_fields=["order", "product_info"],
+            update_fields=["quantity"],
+        )
+        refresh_order_totals([order.id])
+        basket_changed(user.id)
         return order   
     
     def update(self, instance, validated_data):
@@ -284,4 +361,17 @@ class OrderConfirmationSerializer(serializers.Serializer):
                     "error": "Не указан номер телефона",
                 }
             )
-        return order
\ No newline at end of file
+        return order
+
+
+class OrderCancelSerializer(serializers.Serializer):
+    id = serializers.IntegerField(write_only=True)
+
+    def validate(self, data):
+        user = self.context["request"].user
+        order = Order.objects.filter(id=data["id"], user_id=user.id).exclude(state="basket").first()
+        if not order:
+            raise serializers.ValidationError(
+                {"status": "Failure", "error": "Указан не корректный заказ"}
+            )
+        return order
@@ -1,6 +1,11 @@
 from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver, Signal
-from backend.models import ConfirmEmailToken, User
+from backend.cache import bump_catalog_version, category_cache, parameter_cache
+from backend.cards import build_cards
+from backend.models import Category, ConfirmEmailToken, Parameter, Product, ProductInfo, \
+    ProductParameter, Shop, User
 from django_rest_passwordreset.signals import reset_password_token_created
 from django.core.mail import send_mail
 
@@ -39,4 +44,44 @@ def new_order_notify(user, order, sum):
         from_email=settings.EMAIL_HOST_USER,
         recipient_list=[settings.EMAIL_HOST_USER],
         fail_silently=False,
-    )
\ No newline at end of file
+    )
+
+
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=Parameter)
+def dictionary_changed(sender, **kwargs):
+    """Сброс кэша справочника после фиксации изменений"""
+    cache = category_cache if sender is Category else parameter_cache
+    transaction.on_commit(cache.invalidate)
+
+
+@receiver([post_save, post_delete], sender=Shop)
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=ProductInfo)
+@receiver([post_save, post_delete], sender=Parameter)
+@receiver([post_save, post_delete], sender=ProductParameter)
+def catalog_changed(sender, **kwargs):
+    """Смена версии каталога после изменений через админку, API и т.п."""
+    transaction.on_commit(bump_catalog_version)
+
+
+@receiver(post_save, sender=ProductInfo)
+@receiver([post_save, post_delete], sender=ProductParameter)
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Parameter)
+def card_changed(sender, instance, **kwargs):
+    """Пересборка карточек затронутых позиций после фиксации изменений"""
+    if sender is ProductInfo:
+        ids = ProductInfo.objects.filter(id=instance.id)
+    elif sender is ProductParameter:
+        ids = ProductInfo.objects.filter(id=instance.product_info_id)
+    elif sender is Product:
+        ids = ProductInfo.objects.filter(product_id=instance.id)
+    elif sender is Parameter:
+        ids = ProductInfo.objects.filter(product_parameters__parameter_id=instance.id)
+    else:
+        ids = ProductInfo.objects.filter(product__category_id=instance.id)
+    ids = ids.values_list("id", flat=True)
+    transaction.on_commit(lambda: build_cards(ids))
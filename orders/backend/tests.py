@@ -1,3 +1,896 @@
-from django.test import TestCase
+import io
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Barrier, Thread
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import OperationalError, connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from backend.cache import DictionaryCache, category_cache, check_shared_cache, \
+    get_catalog_version, parameter_cache
+from backend.facets import facet_rows
+from backend.offers import available_offers, best_offers
+from backend.fetch import PriceListTooLarge, download_price_list
+from backend.importer import PriceListImporter
+from backend.jobs import HEARTBEAT_TIMEOUT, claim_job, fail_orphaned_jobs, load_source, \
+    run_import_job
+from backend.management.commands.import_shops import Command as ImportShopsCommand, \
+    import_shop
+from backend.management.commands.run_import_jobs import Command as RunImportJobsCommand
+from backend.models import User, Shop, Category, Contact, Order, OrderItem, ProductInfo, \
+    ImportJob, Parameter, ParameterFacet
+from backend.parsers import PriceListError, read_price_list
+from backend.reservations import ReservationError, cancel_order, place_order
+from backend.totals import refresh_order_totals, refresh_shop_totals
+from benchmarks.generate import generate_goods
+
+CATEGORIES = 5
+PARAMETERS = 6
+# таблицы, полный просмотр которых недопустим (PostgreSQL)
+INDEXED_TABLES = ("backend_productinfo", "backend_orderitem", "backend_productparameter")
+
+
+def price_list(shop, goods, seed=0):
+    return {
+        "shop": shop,
+        "categories": [{"id": category_id, "name": f"Категория {category_id}"}
+                       for category_id in range(1, CATEGORIES + 1)],
+        "goods": generate_goods(goods, CATEGORIES, PARAMETERS, seed),
+    }
+
+
+class QueryBudgetTestCase(APITestCase):
+    """
+    Бюджет запросов к БД для каждого маршрута backend/urls.py.
+    Маршруты чтения проверяются дважды - до и после увеличения объема данных:
+    число запросов не должно зависеть от размера выдачи.
+    На PostgreSQL дополнительно проверяются планы запросов (EXPLAIN).
+    """
+    # (метод, маршрут, пользователь, бюджет); списки с PageNumberPagination делают COUNT
+    read_routes = (
+        ("get", "/api/v1/categories", None, 2),
+        ("get", "/api/v1/shops", None, 2),
+        ("get", "/api/v1/products", None, 1),
+        ("get", "/api/v1/products?category_id=1", None, 1),
+        ("get", "/api/v1/products?fields=id,price,quantity,shop", None, 1),
+        ("get", "/api/v1/products?search=Товар", None, 1),
+        ("get", "/api/v1/products?parameter=Параметр 1:черный", None, 2),
+        ("get", "/api/v1/products/facets", None, 2),
+        ("get", "/api/v1/products/facets?parameter=Параметр 1:черный", None, 2),
+        ("get", "/api/v1/products/offers?top=2", None, 1),
+        ("get", "/api/v1/products/offers?category_id=1&search=Товар", None, 1),
+        ("get", "/api/v1/product/id/", None, 1),
+        ("get", "/api/v1/product/id/{product}/", None, 1),
+        ("get", "/api/v1/product/id/?ids={ids}", None, 1),
+        ("get", "/api/v1/user/details", "buyer", 1),
+        ("get", "/api/v1/user/contact/", "buyer", 2),
+        ("get", "/api/v1/user/contact/{contact}/", "buyer", 1),
+        ("get", "/api/v1/basket", "buyer", 2),
+        ("get", "/api/v1/order", "buyer", 2),
+        ("get", "/api/v1/order?fields=id,state,total_sum", "buyer", 1),
+        ("get", "/api/v1/order?state=new&dt_after=2020-01-01&page_size=5", "buyer", 2),
+        ("get", "/api/v1/partner/orders", "shop", 2),
+        ("get", "/api/v1/partner/state/{shop}", "shop", 1),
+        ("get", "/api/v1/partner/update/status/{job}", "shop", 1),
+    )
+
+    def setUp(self):
+        # справочники в памяти процесса и общий кэш не откатываются вместе с транзакцией теста
+        cache.clear()
+        category_cache.invalidate()
+        parameter_cache.invalidate()
+        self.shop_user = User.objects.create_user(email="shop@example.com", password="Pa$$w0rd!",
+                                                  type="shop", is_active=True)
+        self.buyer = User.objects.create_user(email="buyer@example.com", password="Pa$$w0rd!",
+                                              type="buyer", is_active=True)
+        self.contact = Contact.objects.create(user=self.buyer, city="Москва", street="Тверская",
+                                              house="1", phone="+70000000000")
+        self.load_data(goods=20, orders=2)
+        self.shop = Shop.objects.get(user=self.shop_user)
+        self.job = ImportJob.objects.create(user=self.shop_user, shop=self.shop, source="shop.yaml")
+
+    def load_data(self, goods, orders):
+        # повторная загрузка с тем же seed дополняет прайс новыми позициями
+        PriceListImporter(user_id=self.shop_user.id).run(price_list("Магазин", goods))
+        Shop.objects.filter(user=self.shop_user).update(state=True)
+        infos = list(ProductInfo.objects.order_by("-id")[:4])
+        for _ in range(orders):
+            order = Order.objects.create(user=self.buyer, state="new", contact=self.contact)
+            OrderItem.objects.bulk_create(
+                [OrderItem(order=order, product_info=info, quantity=1) for info in infos]
+            )
+        basket, _ = Order.objects.get_or_create(user=self.buyer, state="basket")
+        OrderItem.objects.bulk_create(
+            [OrderItem(order=basket, product_info=info, quantity=1) for info in infos],
+            ignore_conflicts=True,
+        )
+        refresh_order_totals(Order.objects.filter(user=self.buyer).values("id"))
+        refresh_shop_totals(Order.objects.filter(user=self.buyer).values("id"))
+
+    def get_user(self, name):
+        return {"buyer": self.buyer, "shop": self.shop_user}.get(name)
+
+    def request(self, method, url, user=None, data=None):
+        """Запрос с очищенными кэшами; возвращает ответ и выполненные запросы"""
+        self.client.force_authenticate(self.get_user(user))
+        cache.clear()
+        category_cache.invalidate()
+        parameter_cache.invalidate()
+        with CaptureQueriesContext(connection) as context:
+            response = getattr(self.client, method)(url, data, format="json")
+        return response, context.captured_queries
+
+    def assertQueryBudget(self, budget, method, url, user=None, data=None, status_code=200):
+        response, queries = self.request(method, url, user, data)
+        self.assertEqual(response.status_code, status_code, response.content)
+        self.assertLessEqual(len(queries), budget,
+                             "\n".join(query["sql"] for query in queries))
+        self.assertNoSequentialScans(queries)
+        return queries
+
+    def assertNoSequentialScans(self, queries):
+        if connection.vendor != "postgresql":
+            return
+        with connection.cursor() as cursor:
+            # при запрете полного просмотра он остается в плане, только если индекса нет
+            cursor.execute("SET enable_seqscan = off")
+            try:
+                for query in queries:
+                    if not query["sql"].startswith("SELECT"):
+                        continue
+                    cursor.execute(f"EXPLAIN {query['sql']}")
+                    plan = "\n".join(row[0] for row in cursor.fetchall())
+                    for table in INDEXED_TABLES:
+                        self.assertNotIn(f"Seq Scan on {table}", plan, f"{query['sql']}\n{plan}")
+            finally:
+                cursor.execute("SET enable_seqscan = on")
+
+    def format_url(self, url):
+        ids = list(ProductInfo.objects.order_by("-id").values_list("id", flat=True))
+        return url.format(product=ids[-1], ids=",".join(map(str, [*ids, 0])),
+                          contact=self.contact.id, shop=self.shop.id, job=self.job.id)
+
+    def test_read_routes(self):
+        counts = {}
+        for method, url, user, budget in self.read_routes:
+            with self.subTest(url=url):
+                queries = self.assertQueryBudget(budget, method, self.format_url(url), user)
+                counts[url] = len(queries)
+        self.load_data(goods=60, orders=10)
+        for method, url, user, budget in self.read_routes:
+            with self.subTest(url=url, data="x3"):
+                queries = self.assertQueryBudget(budget, method, self.format_url(url), user)
+                self.assertEqual(len(queries), counts[url], "число запросов зависит от объема данных")
+
+    def test_catalog_cache_hit(self):
+        self.client.get("/api/v1/products")
+        with CaptureQueriesContext(connection) as context:
+            self.client.get("/api/v1/products")
+        self.assertEqual(len(context), 0)
+
+    def test_catalog_not_modified(self):
+        for url in ("/api/v1/categories", "/api/v1/shops", "/api/v1/products",
+                    "/api/v1/products/facets"):
+            with self.subTest(url=url):
+                etag = self.client.get(url)["ETag"]
+                with CaptureQueriesContext(connection) as context:
+                    response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(len(context), 0)
+        # после загрузки прайса версия каталога меняется
+        etag = self.client.get("/api/v1/products")["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.load_data(goods=25, orders=0)
+        response = self.client.get("/api/v1/products", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_order_changes_stock_version(self):
+        # остатки другого магазина, справочники и фасеты заказом не затрагиваются
+        kept = ("/api/v1/categories", "/api/v1/products/facets",
+                f"/api/v1/products?shop_id={self.shop.id + 1}")
+        etags = {url: self.client.get(url)["ETag"]
+                 for url in (*kept, "/api/v1/products", f"/api/v1/products?shop_id={self.shop.id}")}
+        version = get_catalog_version()
+        basket = Order.objects.get(user=self.buyer, state="basket")
+        self.client.force_authenticate(self.buyer)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post("/api/v1/order/confirm",
+                                        {"id": basket.id, "contact": self.contact.id}, format="json")
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(get_catalog_version(), version)
+        for url, etag in etags.items():
+            with self.subTest(url=url):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304 if url in kept else 200)
+
+    def test_register(self):
+        self.assertQueryBudget(7, "post", "/api/v1/user/register", data={
+            "first_name": "Иван", "last_name": "Иванов", "email": "new@example.com",
+            "password": "Pa$$w0rd!", "password_confirmation": "Pa$$w0rd!",
+            "company": "ООО", "position": "менеджер",
+        }, status_code=201)
+
+    def test_register_confirm(self):
+        user = User.objects.create_user(email="new@example.com", password="Pa$$w0rd!")
+        token = user.confirm_email_tokens.create()
+        self.assertQueryBudget(4, "post", "/api/v1/user/register/confirm",
+                               data={"email": user.email, "token": token.key})
+
+    def test_login(self):
+        self.assertQueryBudget(5, "post", "/api/v1/user/login",
+                               data={"email": self.buyer.email, "password": "Pa$$w0rd!"})
+
+    def test_user_details_update(self):
+        self.assertQueryBudget(2, "patch", "/api/v1/user/details", "buyer",
+                               data={"company": "ООО Ромашка"})
+
+    def test_contact_create(self):
+        self.assertQueryBudget(1, "post", "/api/v1/user/contact/", "buyer",
+                               data={"city": "Москва", "street": "Арбат", "phone": "+7"},
+                               status_code=201)
+
+    def test_partner_update(self):
+        self.assertQueryBudget(1, "post", "/api/v1/partner/update/url", "shop",
+                               data={"url": "https://example.com/shop.yaml"}, status_code=202)
+        self.assertQueryBudget(1, "post", "/api/v1/partner/update/file", "shop",
+                               data={"filename": "shop.yaml"}, status_code=202)
+
+    def test_partner_state_update(self):
+        self.assertQueryBudget(2, "patch", f"/api/v1/partner/state/{self.shop.id}", "shop",
+                               data={"state": False})
+
+    def test_basket_update(self):
+        infos = list(ProductInfo.objects.filter(quantity__gt=0)[:5])
+        counts = []
+        for size in (1, len(infos)):
+            items = [{"product_info": info.id, "quantity": 1} for info in infos[:size]]
+            counts.append(len(self.assertQueryBudget(8, "post", "/api/v1/basket", "buyer",
+                                                     data={"items": items})))
+            self.assertQueryBudget(8, "put", "/api/v1/basket", "buyer", data={"items": items})
+        self.assertEqual(counts[0], counts[1])
+
+    def test_order_totals(self):
+        infos = list(ProductInfo.objects.filter(quantity__gt=0).order_by("id")[:3])
+        items = [{"product_info": info.id, "quantity": 2} for info in infos]
+        self.request("put", "/api/v1/basket", "buyer", {"items": items})
+        basket = Order.objects.get(user=self.buyer, state="basket")
+        expected = sum(item.quantity * item.product_info.price
+                       for item in basket.ordered_items.select_related("product_info"))
+        response, _ = self.request("get", "/api/v1/basket", "buyer")
+        self.assertEqual(response.data["total_sum"], expected)
+        self.assertEqual(response.data["item_count"],
+                         sum(item.quantity for item in basket.ordered_items.all()))
+        # списки читают сохраненные итоги без агрегации
+        response, queries = self.request("get", "/api/v1/order?fields=id,total_sum,item_count",
+                                         "buyer")
+        self.assertNotIn("SUM(", " ".join(query["sql"] for query in queries).upper())
+        self.assertEqual({order["id"]: order["total_sum"] for order in response.data["results"]},
+                         dict(Order.objects.exclude(state="basket").filter(user=self.buyer)
+                              .values_list("id", "total_sum")))
+
+    def test_order_history(self):
+        self.load_data(goods=20, orders=5)
+        Order.objects.filter(id=Order.objects.filter(state="new").order_by("id").first().id
+                             ).update(state="delivered")
+        orders = Order.objects.filter(user=self.buyer).exclude(state="basket")
+        # страницы по курсору проходят все заказы без повторов и пропусков
+        ids, url = [], "/api/v1/order?fields=id&page_size=2"
+        while url:
+            response = self.client.get(url) if ids else self.request("get", url, "buyer")[0]
+            ids.extend(order["id"] for order in response.data["results"])
+            url = response.data["next"]
+        self.assertEqual(ids, list(orders.order_by("-dt", "-id").values_list("id", flat=True)))
+        response, _ = self.request("get", "/api/v1/order?state=delivered", "buyer")
+        self.assertEqual([order["state"] for order in response.data["results"]], ["delivered"])
+        response, _ = self.request("get", "/api/v1/order?dt_before=2000-01-01", "buyer")
+        self.assertEqual(response.data["results"], [])
+        self.assertQueryBudget(1, "get", "/api/v1/order?state=basket", "buyer", status_code=400)
+
+    def test_basket_cache(self):
+        self.client.force_authenticate(self.buyer)
+        self.client.get("/api/v1/basket")
+        with CaptureQueriesContext(connection) as context:
+            cached = self.client.get("/api/v1/basket").data
+        self.assertEqual(len(context), 0)
+        # после каждой записи корзина читается заново
+        info = ProductInfo.objects.filter(quantity__gt=1).order_by("id").first()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.put("/api/v1/basket", {"items": [{"product_info": info.id, "quantity": 2}]},
+                            format="json")
+        basket = self.client.get("/api/v1/basket").data
+        self.assertNotEqual(basket["total_sum"], cached["total_sum"])
+        self.assertEqual(basket["total_sum"],
+                         Order.objects.get(user=self.buyer, state="basket").total_sum)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post("/api/v1/order/confirm",
+                             {"id": basket["id"], "contact": self.contact.id}, format="json")
+        self.assertFalse(self.client.get("/api/v1/basket").data.get("ordered_items"))
+
+    def test_partner_order_totals(self):
+        other_user = User.objects.create_user(email="other@example.com", type="shop")
+        PriceListImporter(user_id=other_user.id).run(price_list("Другой магазин", 2, seed=1))
+        own = ProductInfo.objects.filter(shop=self.shop).order_by("id").first()
+        other = ProductInfo.objects.filter(shop__user=other_user).order_by("id").first()
+        ProductInfo.objects.filter(id__in=[own.id, other.id]).update(quantity=10)
+        order = Order.objects.create(user=self.buyer, state="basket")
+        OrderItem.objects.bulk_create([OrderItem(order=order, product_info=own, quantity=2),
+                                       OrderItem(order=order, product_info=other, quantity=3)])
+        place_order(order, self.contact)
+        # итоги фиксируются при оформлении, как и сумма заказа покупателя
+        ProductInfo.objects.filter(id=own.id).update(price=own.price + 1000)
+        self.client.force_authenticate(self.shop_user)
+        with CaptureQueriesContext(connection) as context:
+            rows = self.client.get("/api/v1/partner/orders?fields=id,total_sum,item_count").data
+        self.assertEqual(len(context), 1)
+        self.assertNotIn("SUM(", context.captured_queries[0]["sql"].upper())
+        row = next(row for row in rows if row["id"] == order.id)
+        # суммы позиций другого магазина поставщику не видны
+        self.assertEqual(row["total_sum"], own.price * 2)
+        self.assertEqual(row["item_count"], 2)
+        self.assertEqual(Order.objects.get(id=order.id).total_sum,
+                         own.price * 2 + other.price * 3)
+
+    def test_basket_delete(self):
+        self.assertQueryBudget(5, "delete", "/api/v1/basket", "buyer")
+
+    def test_order_confirm(self):
+        basket = Order.objects.get(user=self.buyer, state="basket")
+        self.assertQueryBudget(10, "post", "/api/v1/order/confirm", "buyer",
+                               data={"id": basket.id, "contact": self.contact.id})
+
+    def test_order_cancel(self):
+        order = Order.objects.filter(user=self.buyer, state="new").first()
+        self.assertQueryBudget(7, "post", "/api/v1/order/cancel", "buyer", data={"id": order.id})
+
+
+class StockReservationTestCase(TransactionTestCase):
+    """
+    Параллельное подтверждение заказов одного товара:
+    товар не продается сверх остатка, взаимных блокировок нет.
+    """
+    buyers = 8
+    stock = 3
+
+    def setUp(self):
+        category_cache.invalidate()
+        parameter_cache.invalidate()
+        shop_user = User.objects.create_user(email="shop@example.com", type="shop")
+        PriceListImporter(user_id=shop_user.id).run(price_list("Магазин", 2))
+        self.scarce, self.plenty = ProductInfo.objects.order_by("id")
+        ProductInfo.objects.filter(id=self.scarce.id).update(quantity=self.stock)
+        ProductInfo.objects.filter(id=self.plenty.id).update(quantity=100)
+        self.orders = []
+        for number in range(self.buyers):
+            buyer = User.objects.create_user(email=f"buyer{number}@example.com")
+            contact = Contact.objects.create(user=buyer, city="Москва", street="Тверская",
+                                             house="1", phone="+70000000000")
+            order = Order.objects.create(user=buyer, state="basket", contact=contact)
+            # позиции в разном порядке - блокировки все равно берутся по возрастанию id
+            infos = [self.scarce, self.plenty] if number % 2 else [self.plenty, self.scarce]
+            for info in infos:
+                OrderItem.objects.create(order=order, product_info=info, quantity=1)
+            self.orders.append(order)
+
+    def confirm(self, order, barrier):
+        try:
+            barrier.wait()
+            place_order(order, order.contact)
+            return "placed"
+        except ReservationError:
+            return "rejected"
+        finally:
+            connection.close()
+
+    # нужны блокировки строк; SQLite в памяти сразу отвечает "database table is locked"
+    @skipUnlessDBFeature("has_select_for_update")
+    def test_parallel_confirmations(self):
+        barrier = Barrier(self.buyers)
+        with ThreadPoolExecutor(max_workers=self.buyers) as executor:
+            results = list(executor.map(self.confirm, self.orders, [barrier] * self.buyers))
+        self.assertEqual(results.count("placed"), self.stock)
+        self.assertEqual(results.count("rejected"), self.buyers - self.stock)
+        self.scarce.refresh_from_db()
+        self.plenty.refresh_from_db()
+        self.assertEqual(self.scarce.quantity, 0)
+        self.assertEqual(self.plenty.quantity, 100 - self.stock)
+        self.assertEqual(Order.objects.filter(state="new").count(), self.stock)
+        self.assertEqual(Order.objects.filter(state="basket").count(), self.buyers - self.stock)
+
+    def test_cancel_releases_stock(self):
+        order = self.orders[0]
+        place_order(order, order.contact)
+        # сумма фиксируется при оформлении
+        self.assertEqual(order.total_sum, self.scarce.price + self.plenty.price)
+        self.assertEqual(order.item_count, 2)
+        with self.assertRaises(ReservationError):
+            place_order(order, order.contact)
+        cancel_order(order)
+        self.scarce.refresh_from_db()
+        self.assertEqual(self.scarce.quantity, self.stock)
+        self.assertEqual(self.scarce.card.document["quantity"], self.stock)
+        with self.assertRaises(ReservationError):
+            cancel_order(order)
+
+    def test_cancel_unreserved_order(self):
+        # заказ, размещенный до резервирования остатков
+        order = self.orders[0]
+        Order.objects.filter(id=order.id).update(state="new")
+        cancel_order(order)
+        self.assertEqual(Order.objects.get(id=order.id).state, "canceled")
+        self.scarce.refresh_from_db()
+        self.assertEqual(self.scarce.quantity, self.stock)
+
+
+YAML_GOODS = """\
+goods:
+  - id: 1
+    category: 224
+    model: apple/iphone/xr
+    name: Смартфон Apple iPhone XR
+    price: 65000
+    price_rrc: 69990
+    quantity: 9
+    parameters:
+      "Цвет": красный
+"""
+YAML_CATEGORIES = """\
+categories:
+  - id: 224
+    name: Смартфоны
+"""
+
+
+def read_yaml(text):
+    return read_price_list(io.BytesIO(text.encode()), source="shop.yaml")
+
+
+class PriceListParserTestCase(SimpleTestCase):
+    """Разбор прайсов разных форматов"""
+
+    def test_yaml_sections_after_goods(self):
+        data = read_yaml("shop: Магазин\n" + YAML_GOODS + YAML_CATEGORIES)
+        self.assertEqual(data["categories"], [])
+        goods = list(data["goods"])
+        self.assertEqual([item["id"] for item in goods], [1])
+        # разделы после товаров доступны после чтения товаров
+        self.assertEqual(data["categories"], [{"id": 224, "name": "Смартфоны"}])
+
+    def test_yaml_shop_required_before_goods(self):
+        with self.assertRaises(PriceListError):
+            read_yaml(YAML_CATEGORIES + YAML_GOODS + "shop: Магазин\n")
+
+
+CSV_HEADER = "shop,category,category_name,id,model,name,price,price_rrc,quantity,Цвет\n"
+CSV_ROW = "{shop},224,Смартфоны,1,apple/iphone/xr,Смартфон Apple iPhone XR,{price},69990,9,красный\n"
+JSONL_PRICE_LIST = (
+    '{"shop": "Магазин", "categories": [{"id": 224, "name": "Смартфоны"}]}\n'
+    '\n'
+    '{"id": 1, "category": 224, "model": "apple/iphone/xr", "name": "Смартфон Apple iPhone XR", '
+    '"price": 65000, "price_rrc": 69990, "quantity": 9, "parameters": {"Цвет": "красный"}}\n'
+)
+
+
+def read_text(text, source):
+    data = read_price_list(io.BytesIO(text.encode()), source=source)
+    return {"shop": data["shop"], "goods": list(data["goods"]), "categories": data["categories"]}
+
+
+class PriceListFormatsTestCase(SimpleTestCase):
+    """CSV и JSON Lines дают те же записи, что и YAML; ошибки структуры - PriceListError"""
+
+    def test_same_records(self):
+        expected = read_text("shop: Магазин\n" + YAML_CATEGORIES + YAML_GOODS, "shop.yaml")
+        self.assertEqual(read_text(CSV_HEADER + CSV_ROW.format(shop="Магазин", price=65000),
+                                   "shop.csv"), expected)
+        self.assertEqual(read_text(JSONL_PRICE_LIST, "shop.jsonl"), expected)
+
+    def test_csv_errors(self):
+        row = CSV_ROW.format(shop="Магазин", price=65000)
+        cases = {
+            "нет заголовка": "",
+            "нет колонки shop": CSV_HEADER.replace("shop,", "") + row.replace("Магазин,", ""),
+            "не указан магазин": CSV_HEADER + CSV_ROW.format(shop="", price=65000),
+            "цена не число": CSV_HEADER + CSV_ROW.format(shop="Магазин", price="65 000"),
+            "короткая строка": CSV_HEADER + row + "Магазин,224,Смартфоны,2\n",
+        }
+        for case, text in cases.items():
+            with self.subTest(case), self.assertRaises(PriceListError):
+                read_text(text, "shop.csv")
+
+    def test_jsonl_errors(self):
+        cases = {
+            "пустой прайс": "",
+            "нет магазина": '{"categories": []}\n',
+            "не корректный JSON": JSONL_PRICE_LIST + "{id: 2}\n",
+            "не объект": JSONL_PRICE_LIST + "[2]\n",
+        }
+        for case, text in cases.items():
+            with self.subTest(case), self.assertRaises(PriceListError):
+                read_text(text, "shop.jsonl")
+
+
+class PriceListImportTestCase(TestCase):
+    """Загрузка прайса в БД"""
+
+    def setUp(self):
+        category_cache.invalidate()
+        parameter_cache.invalidate()
+        self.user = User.objects.create_user(email="shop@example.com", type="shop")
+
+    def test_yaml_categories_after_goods(self):
+        PriceListImporter(user_id=self.user.id).run(
+            read_yaml("shop: Магазин\n" + YAML_GOODS + YAML_CATEGORIES))
+        self.assertEqual(Category.objects.get(id=224).name, "Смартфоны")
+        self.assertEqual(ProductInfo.objects.get().product.category_id, 224)
+
+    def test_category_deleted_elsewhere(self):
+        Category.objects.create(id=224, name="Смартфоны")
+        self.assertEqual(category_cache.get_name(224), "Смартфоны")
+        # удаление в другом процессе: кэш этого процесса о нем не знает
+        Category.objects.filter(id=224)._raw_delete(Category.objects.db)
+        PriceListImporter(user_id=self.user.id).run(
+            read_yaml("shop: Магазин\n" + YAML_CATEGORIES + YAML_GOODS))
+        self.assertTrue(Category.objects.filter(id=224).exists())
+
+    def price_list(self, goods):
+        return {"shop": "Магазин", "categories": [{"id": 224, "name": "Смартфоны"}],
+                "goods": [
+                    {"id": external_id, "category": 224, "model": f"model/{external_id}",
+                     "name": f"Товар {external_id}", "price": price, "price_rrc": price,
+                     "quantity": 5, "parameters": parameters}
+                    for external_id, price, parameters in goods
+                ]}
+
+    def test_incremental_import(self):
+        importer = PriceListImporter(user_id=self.user.id)
+        summary = importer.run(self.price_list([
+            (1, 100, {"Цвет": "черный"}), (2, 200, {"Цвет": "белый"}),
+            (3, 300, {"Цвет": "синий"}), (4, 400, {}),
+        ]))
+        self.assertEqual(summary, {"inserted": 4, "updated": 0, "unchanged": 0, "removed": 0})
+        infos = {info.external_id: info for info in ProductInfo.objects.all()}
+        first_ids = {external_id: info.id for external_id, info in infos.items()}
+        buyer = User.objects.create_user(email="buyer@example.com")
+        order = Order.objects.create(user=buyer, state="new")
+        OrderItem.objects.create(order=order, product_info=infos[4], quantity=1)
+
+        # 1 - без изменений, 2 - новая цена, 3 - только параметры, 4 - снят с продажи, 5 - новый
+        summary = PriceListImporter(user_id=self.user.id).run(self.price_list([
+            (1, 100, {"Цвет": "черный"}), (2, 250, {"Цвет": "белый"}),
+            (3, 300, {"Цвет": "красный"}), (5, 500, {}),
+        ]))
+        self.assertEqual(summary, {"inserted": 1, "updated": 2, "unchanged": 1, "removed": 1})
+        infos = {info.external_id: info for info in ProductInfo.objects.all()}
+        self.assertEqual(infos[2].price, 250)
+        self.assertEqual(list(infos[3].product_parameters.values_list("value", flat=True)),
+                         ["красный"])
+        self.assertEqual(infos[3].card.document["product_parameters"],
+                         [{"parameter": "Цвет", "value": "красный"}])
+        # снятая с продажи позиция остается вместе с позицией заказа
+        self.assertEqual(infos[4].quantity, 0)
+        self.assertTrue(OrderItem.objects.filter(order=order, product_info=infos[4]).exists())
+        # существующие позиции обновляются на месте
+        self.assertEqual({external_id: infos[external_id].id for external_id in first_ids},
+                         first_ids)
+
+        summary = PriceListImporter(user_id=self.user.id).run(self.price_list([
+            (1, 100, {"Цвет": "черный"}), (2, 250, {"Цвет": "белый"}),
+            (3, 300, {"Цвет": "красный"}), (5, 500, {}),
+        ]))
+        self.assertEqual(summary, {"inserted": 0, "updated": 0, "unchanged": 4, "removed": 0})
+
+
+    def test_merge_lookup_uses_index(self):
+        lookup = ProductInfo.objects.filter(shop_id=1, external_id__in=[1, 2, 3])
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                cursor.execute("SET enable_seqscan = off")
+        self.assertIn("product_info_shop_external", lookup.explain())
+
+    def test_full_import_keeps_placed_orders(self):
+        PriceListImporter(user_id=self.user.id).run(self.price_list([
+            (1, 100, {"Цвет": "черный"}), (2, 200, {"Цвет": "белый"}), (3, 300, {}),
+        ]))
+        infos = {info.external_id: info for info in ProductInfo.objects.all()}
+        buyer = User.objects.create_user(email="buyer@example.com")
+        placed = Order.objects.create(user=buyer, state="new")
+        OrderItem.objects.create(order=placed, product_info=infos[1], quantity=1)
+        OrderItem.objects.create(order=placed, product_info=infos[2], quantity=1)
+        basket = Order.objects.create(user=buyer, state="basket")
+        OrderItem.objects.create(order=basket, product_info=infos[3], quantity=1)
+
+        summary = PriceListImporter(user_id=self.user.id, incremental=False).run(
+            self.price_list([(1, 150, {"Цвет": "черный"}), (4, 400, {})]))
+        self.assertEqual(summary, {"inserted": 1, "updated": 1, "unchanged": 0, "removed": 2})
+        # позиции размещенного заказа остаются: 1 обновлена, 2 снята с продажи
+        self.assertEqual(placed.ordered_items.count(), 2)
+        current = {info.external_id: info for info in ProductInfo.objects.all()}
+        self.assertEqual(current[1].id, infos[1].id)
+        self.assertEqual(current[1].price, 150)
+        self.assertEqual(current[2].quantity, 0)
+        self.assertNotIn(3, current)
+        self.assertFalse(basket.ordered_items.exists())
+        self.assertEqual(current[4].card.document["price"], 400)
+
+    def test_offers_count_shops(self):
+        data = self.price_list([(1, 100, {}), (2, 90, {})])
+        for item in data["goods"]:
+            item["name"] = "Товар"
+        PriceListImporter(user_id=self.user.id).run(data)
+        other = User.objects.create_user(email="other@example.com", type="shop")
+        data = self.price_list([(1, 120, {})])
+        data["shop"] = "Другой магазин"
+        data["goods"][0]["name"] = "Товар"
+        PriceListImporter(user_id=other.id).run(data)
+        Shop.objects.update(state=True)
+        # два предложения одного магазина считаются одним магазином
+        (product,), _ = best_offers(available_offers())
+        self.assertEqual(product["shops"], 2)
+        self.assertEqual([offer["price"] for offer in product["offers"]], [90, 100, 120])
+
+    def test_incremental_facets(self):
+        PriceListImporter(user_id=self.user.id).run(self.price_list([
+            (1, 100, {"Цвет": "черный"}), (2, 200, {"Цвет": "белый"}),
+            (3, 300, {"Цвет": "черный"}),
+        ]))
+        # 2 - новый цвет, 3 - перенесен в другую категорию, 4 - новый
+        data = self.price_list([
+            (1, 100, {"Цвет": "черный"}), (2, 200, {"Цвет": "красный"}),
+            (3, 300, {"Цвет": "черный"}), (4, 400, {"Цвет": "белый"}),
+        ])
+        data["categories"].append({"id": 225, "name": "Планшеты"})
+        data["goods"][2]["category"] = 225
+        PriceListImporter(user_id=self.user.id).run(data)
+        shop = Shop.objects.get(user=self.user)
+        facets = sorted(ParameterFacet.objects.filter(shop=shop)
+                        .values_list("category_id", "parameter_id", "value", "count"))
+        # счетчики совпадают с полным пересчетом
+        self.assertEqual(facets, sorted(
+            (row["product_info__product__category_id"], row["parameter_id"], row["value"],
+             row["count"]) for row in facet_rows(shop.id)))
+        self.assertEqual([(category_id, value, count) for category_id, _, value, count in facets],
+                         [(224, "белый", 1), (224, "красный", 1), (224, "черный", 1),
+                          (225, "черный", 1)])
+
+        # прайс без изменений не переписывает счетчики
+        with CaptureQueriesContext(connection) as context:
+            PriceListImporter(user_id=self.user.id).run(data)
+        self.assertFalse([query["sql"] for query in context.captured_queries
+                          if "backend_parameterfacet" in query["sql"]
+                          and not query["sql"].startswith("SELECT")])
+
+    def test_parameter_renamed(self):
+        PriceListImporter(user_id=self.user.id).run(self.price_list([
+            (1, 100, {"Цвет": "черный"}),
+        ]))
+        parameter = Parameter.objects.get(name="Цвет")
+        parameter.name = "Окрас"
+        with self.captureOnCommitCallbacks(execute=True):
+            parameter.save()
+        self.assertEqual(ProductInfo.objects.get().card.document["product_parameters"],
+                         [{"parameter": "Окрас", "value": "черный"}])
+
+    def test_facets_shop_filter(self):
+        PriceListImporter(user_id=self.user.id).run(self.price_list([
+            (1, 100, {"Цвет": "черный"}),
+        ]))
+        other = User.objects.create_user(email="other@example.com", type="shop")
+        data = self.price_list([(1, 100, {"Цвет": "белый"})])
+        data["shop"] = "Другой магазин"
+        PriceListImporter(user_id=other.id).run(data)
+        shop = Shop.objects.get(user=self.user)
+        cache.clear()
+        for query in (f"shop_id={shop.id}", f"shop__id={shop.id}",
+                      f"shop__id={shop.id}&product__category_id=224"):
+            with self.subTest(query=query):
+                response = self.client.get(f"/api/v1/products/facets?{query}")
+                self.assertEqual(response.json(), [
+                    {"parameter": "Цвет", "values": [{"value": "черный", "count": 1}]},
+                ])
+
+class ImportJobTestCase(TransactionTestCase):
+    """Задания на загрузку прайса и import_shops: очередь, выполнение, прерванные задания"""
+
+    def setUp(self):
+        category_cache.invalidate()
+        parameter_cache.invalidate()
+        self.user = User.objects.create_user(email="shop@example.com", type="shop")
+
+    def test_run_job(self):
+        job = ImportJob.objects.create(user=self.user, source="./data/shop.yaml")
+        self.assertEqual(claim_job(), job.id)
+        self.assertIsNone(claim_job())
+        run_import_job(job.id)
+        job.refresh_from_db()
+        self.assertEqual(job.state, "done", job.error)
+        self.assertEqual(job.total, ProductInfo.objects.count())
+        self.assertEqual(job.processed, job.total)
+        self.assertEqual(job.size, os.path.getsize("./data/shop.yaml"))
+        self.assertEqual(job.read, job.size)
+
+    def test_import_shops_dir(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for name, shop in (("shop.yaml", "МВидео"), ("renamed.yaml", "Магазин"),
+                               ("unknown.yaml", "Неизвестный")):
+                with open(os.path.join(directory, name), "w", encoding="utf-8") as stream:
+                    stream.write(f"shop: {shop}\n" + YAML_CATEGORIES + YAML_GOODS)
+            by_file = Shop.objects.create(name="Другое название", user=self.user,
+                                          filename=os.path.join(directory, "shop.yaml"))
+            other = User.objects.create_user(email="other@example.com", type="shop")
+            by_name = Shop.objects.create(name="Магазин", user=other)
+            Shop.objects.create(name="Неизвестный")
+            command = ImportShopsCommand(stderr=io.StringIO())
+            tasks = command.get_tasks({"dir": directory, "shops": [], "all": False})
+            # файл без магазина с владельцем пропускается, а не создает магазин без владельца
+            self.assertEqual(sorted(shop_id for _, shop_id in tasks), [by_file.id, by_name.id])
+            self.assertIn("unknown.yaml", command.stderr.getvalue())
+            # прайс загружается в найденный магазин, даже если название в файле другое
+            results = [import_shop(source, shop_id) for source, shop_id in tasks]
+        self.assertEqual([result["status"] for result in results], ["done", "done"],
+                         [result.get("error") for result in results])
+        self.assertEqual(Shop.objects.filter(user__isnull=False).count(), 2)
+        self.assertEqual(ProductInfo.objects.filter(shop=by_file).count(), 1)
+        self.assertEqual(ProductInfo.objects.filter(shop=by_name).count(), 1)
+
+    def test_fail_orphaned_jobs(self):
+        now = timezone.now()
+        deadline = now - timedelta(seconds=HEARTBEAT_TIMEOUT + 1)
+        stale = ImportJob.objects.create(user=self.user, source="a.yaml", state="running",
+                                         heartbeat_at=deadline)
+        alive = ImportJob.objects.create(user=self.user, source="b.yaml", state="running",
+                                         heartbeat_at=now)
+        self.assertEqual(fail_orphaned_jobs(), 1)
+        stale.refresh_from_db()
+        alive.refresh_from_db()
+        self.assertEqual(stale.state, "failed")
+        self.assertEqual(alive.state, "running")
+
+    def test_sweep_on_sqlite(self):
+        # на SQLite отметки о работе во время импорта не пишутся - задание выглядит прерванным
+        job = ImportJob.objects.create(user=self.user, source="a.yaml", state="running",
+                                       heartbeat_at=timezone.now() - timedelta(days=1))
+        command = RunImportJobsCommand(stderr=io.StringIO())
+        command.sqlite = True
+        command.sweep(running={"future": job.id})
+        job.refresh_from_db()
+        self.assertEqual(job.state, "running")
+        command.sweep(running={})
+        job.refresh_from_db()
+        self.assertEqual(job.state, "failed")
+
+    def test_sweep_database_locked(self):
+        command = RunImportJobsCommand(stderr=io.StringIO())
+        with mock.patch("backend.management.commands.run_import_jobs.fail_orphaned_jobs",
+                        side_effect=OperationalError("database is locked")):
+            command.sweep(running={})
+        self.assertIn("database is locked", command.stderr.getvalue())
+
+
+class PriceListHandler(BaseHTTPRequestHandler):
+    """Сервер поставщика: прайс с ETag / Last-Modified и условными ответами 304"""
+    last_modified = "Wed, 21 Oct 2015 07:28:00 GMT"
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(dict(self.headers))
+        if self.headers.get("If-None-Match") == server.etag or \
+                self.headers.get("If-Modified-Since") == self.last_modified:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/yaml")
+        self.send_header("ETag", server.etag)
+        self.send_header("Last-Modified", self.last_modified)
+        # без Content-Length размер известен только по мере чтения (до закрытия соединения)
+        if server.content_length:
+            self.send_header("Content-Length", str(len(server.body)))
+        self.end_headers()
+        self.wfile.write(server.body)
+
+    def log_message(self, *args):
+        pass
+
+
+class PriceListDownloadTestCase(TestCase):
+    """Загрузка прайса по ссылке с локального сервера поставщика"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), PriceListHandler)
+        Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.url = f"http://127.0.0.1:{cls.server.server_address[1]}/shop.yaml"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        category_cache.invalidate()
+        parameter_cache.invalidate()
+        with open("./data/shop.yaml", "rb") as stream:
+            self.server.body = stream.read()
+        self.server.etag = '"v1"'
+        self.server.content_length = True
+        self.server.requests = []
+
+    def test_download(self):
+        with download_price_list(self.url, 10 ** 6) as download:
+            self.assertEqual(download.stream.read(), self.server.body)
+            self.assertEqual(download.etag, '"v1"')
+            self.assertEqual(download.last_modified, PriceListHandler.last_modified)
+            self.assertEqual(download.content_type, "application/yaml")
+
+    def test_not_modified(self):
+        for headers in ({"etag": '"v1"'}, {"last_modified": PriceListHandler.last_modified}):
+            with self.subTest(**headers):
+                with download_price_list(self.url, 10 ** 6, **headers) as download:
+                    self.assertTrue(download.not_modified)
+        self.assertEqual(self.server.requests[0]["If-None-Match"], '"v1"')
+        self.assertEqual(self.server.requests[1]["If-Modified-Since"],
+                         PriceListHandler.last_modified)
+
+    def test_unchanged_content_skipped(self):
+        user = User.objects.create_user(email="shop@example.com", type="shop")
+        importer = PriceListImporter(user_id=user.id)
+        self.assertIsNotNone(load_source(importer, self.url))
+        shop = Shop.objects.get(user=user)
+        self.assertEqual(shop.etag, '"v1"')
+        # новый ETag, то же содержимое - прайс не разбирается
+        self.server.etag = '"v2"'
+        importer = PriceListImporter(user_id=user.id)
+        self.assertIsNone(load_source(importer, self.url, shop))
+        self.assertEqual(importer.processed, 0)
+        self.assertEqual(self.server.requests[-1]["If-None-Match"], '"v1"')
+
+    def test_too_large(self):
+        for content_length in (True, False):
+            with self.subTest(content_length=content_length):
+                self.server.content_length = content_length
+                with self.assertRaises(PriceListTooLarge):
+                    download_price_list(self.url, len(self.server.body) - 1)
+
+
+class SharedCacheCheckTestCase(SimpleTestCase):
+    def test_process_local_cache(self):
+        local = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+        with self.settings(CACHES=local):
+            self.assertEqual([error.id for error in check_shared_cache(None)], ["backend.E001"])
+        self.assertEqual(check_shared_cache(None), [])
+
+
+class DictionaryCacheTestCase(TestCase):
+    """Кэш справочника в памяти процесса и его сброс из других процессов"""
+
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(id=1, name="Смартфоны")
+
+    def test_invalidated_by_other_process(self):
+        local = DictionaryCache(Category, check_interval=0)
+        other = DictionaryCache(Category, check_interval=0)
+        self.assertEqual(local.get_name(1), "Смартфоны")
+        Category.objects.filter(id=1).update(name="Телефоны")
+        self.assertEqual(local.get_name(1), "Смартфоны")
+        # сигнал об изменении обработан в другом процессе
+        other.invalidate()
+        self.assertEqual(local.get_name(1), "Телефоны")
+        self.assertEqual(local.get_id("Телефоны"), 1)
+
+    def test_ttl(self):
+        local = DictionaryCache(Category, ttl=0, check_interval=0)
+        self.assertEqual(local.get_name(1), "Смартфоны")
+        Category.objects.filter(id=1).update(name="Телефоны")
+        self.assertEqual(local.get_name(1), "Телефоны")
 
-# Create your tests here.
@@ -0,0 +1,56 @@
+"""
+Итоги заказов (сумма и количество товаров), хранящиеся в Order.
+Пересчитываются одним UPDATE с подзапросами при каждом изменении позиций,
+списки заказов читают их без агрегации и соединений.
+Для размещенных заказов итоги хранятся еще и по магазинам (OrderShopTotal) -
+поставщик видит суммы только своих позиций.
+"""
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from backend.models import Order, OrderItem, OrderShopTotal
+
+
+def item_total(expression):
+    """Подзапрос: сумма expression по позициям заказа"""
+    return Coalesce(Subquery(
+        OrderItem.objects.filter(order_id=OuterRef("pk")).order_by().values("order_id")
+        .annotate(total=Sum(expression)).values("total")
+    ), Value(0))
+
+
+def refresh_order_totals(order_ids):
+    """Пересчет итогов заказов по текущим позициям и ценам"""
+    return Order.objects.filter(id__in=order_ids).update(
+        total_sum=item_total(F("quantity") * F("product_info__price")),
+        item_count=item_total(F("quantity")),
+    )
+
+
+def refresh_shop_totals(order_ids):
+    """
+    Пересчет итогов размещенных заказов по магазинам по текущим ценам (корзины поставщикам не видны).
+    При оформлении итоги записывает place_order - по ценам на этот момент.
+    """
+    placed = Order.objects.filter(id__in=order_ids).exclude(state="basket").values("id")
+    OrderShopTotal.objects.filter(order_id__in=placed).delete()
+    OrderShopTotal.objects.bulk_create(
+        OrderShopTotal(order_id=row["order_id"], shop_id=row["product_info__shop_id"],
+                       total_sum=row["total_sum"], item_count=row["item_count"])
+        for row in OrderItem.objects.filter(order_id__in=placed)
+        .values("order_id", "product_info__shop_id")
+        .annotate(total_sum=Sum(F("quantity") * F("product_info__price")),
+                  item_count=Sum("quantity"))
+        .order_by()
+    )
+
+
+def refresh_shop_baskets(shop_id):
+    """
+    Пересчет корзин с позициями магазина (после загрузки прайса с новыми ценами).
+    Итоги размещенных заказов не меняются - в них сумма на момент оформления.
+    """
+    return refresh_order_totals(
+        OrderItem.objects.filter(product_info__shop_id=shop_id, order__state="basket")
+        .values("order_id")
+    )
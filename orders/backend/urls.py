@@ -3,7 +3,8 @@ from rest_framework.routers import DefaultRouter
 
 from backend.views import RegisterAccountView, ConfirmAccountView, LoginAccountView, ContactView, \
     AccountDetails, PartnerUpdateURL, PartnerUpdateFILE, PartnerState, CategoryView, ShopView, \
-    ProductInfoView, BasketView, OrderView, OrderViewConfirm, PartnerOrders, ProductInfoViewID
+    ProductInfoView, BasketView, OrderView, OrderViewConfirm, PartnerOrders, ProductInfoViewID, \
+    PartnerUpdateStatus, ProductFacetView, ProductOffersView, OrderViewCancel
 
 app_name = 'backend'
 
@@ -19,13 +20,17 @@ urlpatterns = [
     path('user/details', AccountDetails.as_view(), name='user-details'),
     path('partner/update/url', PartnerUpdateURL.as_view(), name='partner-update-url'),
     path('partner/update/file', PartnerUpdateFILE.as_view(), name='partner-update-file'),
+    path('partner/update/status/<int:pk>', PartnerUpdateStatus.as_view(), name='partner-update-status'),
     path('partner/state/<int:pk>', PartnerState.as_view(), name='partner-state'),
     path('partner/orders', PartnerOrders.as_view(), name='partner-orders'),
     path('categories', CategoryView.as_view(), name='categories'),
     path('shops', ShopView.as_view(), name='shops'),
     path('products', ProductInfoView.as_view(), name='products'),
+    path('products/facets', ProductFacetView.as_view(), name='product-facets'),
+    path('products/offers', ProductOffersView.as_view(), name='product-offers'),
     path('basket', BasketView.as_view(), name='basket'),
     path('order', OrderView.as_view(), name='order'),
     path('order/confirm', OrderViewConfirm.as_view(), name='order'),
+    path('order/cancel', OrderViewCancel.as_view(), name='order-cancel'),
     path('', include(router.urls)),
 ]
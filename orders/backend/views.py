@@ -1,26 +1,38 @@
 
+from django.conf import settings
 from django_filters.rest_framework import DjangoFilterBackend
-from django.db.models import Sum, F
+from django.db import transaction
+from django.db.models import F
 
 from rest_framework import status
-from requests import get
 from rest_framework.authtoken.models import Token
-from rest_framework.generics import ListAPIView, RetrieveUpdateAPIView
+from rest_framework.exceptions import ValidationError
+from rest_framework.utils.urls import replace_query_param
+from rest_framework.generics import GenericAPIView, ListAPIView, RetrieveAPIView, RetrieveUpdateAPIView
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.viewsets import ModelViewSet
-from yaml import load as load_yaml, Loader
-import yaml
 
-from backend.models import User, Shop, Category, Product, ProductInfo, Parameter, ProductParameter,\
-    ConfirmEmailToken, Contact, Order, OrderItem
+from backend.models import User, Shop, Category, ProductInfo, ConfirmEmailToken, Contact, Order,\
+    OrderItem, ImportJob
+
+from backend.builders import ORDER_FIELDS, build_orders, order_columns, render_orders
+from backend.cache import CatalogCacheMixin, basket_changed, cached_basket
+from backend.cards import ProductCardMixin
+from backend.facets import precomputed_facets, queryset_facets
+from backend.offers import available_offers, best_offers
+from backend.jobs import start_import_job
 
 from backend.serializers import NewAccountSerializer, AccountConfirmationSerializer, \
     AccountLoginSerializer, AccountContactSerializer, AccountSerializer, PartnerUpdateSerializer, \
     PartnerStateSerialiser, CategorySerializer, ShopSerializer, ProductInfoSerializer, \
-    OrderSerializer, OrderConfirmationSerializer
-from backend.filters import ProductFilter
+    OrderSerializer, OrderConfirmationSerializer, ImportJobSerializer, PartnerUpdateFileSerializer, \
+    OrderCancelSerializer
+from backend.filters import OrderFilter, ProductFilter, SparseFieldsMixin, parse_fields, \
+    parse_ids
+from backend.pagination import OrderCursorPagination, ProductCursorPagination
+from backend.reservations import ReservationError, cancel_order, place_order
 from backend.permissions import UserIsOwner, UserIsShop
 from backend.signals import new_user_registered_mail, new_order_created_mail, new_order_notify
 
@@ -126,96 +138,42 @@ class PartnerUpdateURL(APIView):
         serializer = PartnerUpdateSerializer(data=request.data)
         if not serializer.is_valid():
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-        url = serializer.validated_data.get("url")
-        try:
-            stream = get(url).content
-            data = load_yaml(stream, Loader=Loader)
-        except yaml.YAMLError as exc:
-                print(exc)
-                return Response(
-                        {"status": "Failure", "error": "Ошибка загрузки по ссылке"},
-                        status=status.HTTP_400_BAD_REQUEST,
-                    )
-                
-        shop, _ = Shop.objects.get_or_create(name=data["shop"], user_id=request.user.id)
-
-        for category in data["categories"]:
-            category_object, _ = Category.objects.get_or_create(
-                id=category["id"], name=category["name"]
-            )
-            category_object.shops.add(shop.id)
-            category_object.save()
-
-        ProductInfo.objects.filter(shop_id=shop.id).delete()
-
-        for item in data["goods"]:
-            product, _ = Product.objects.get_or_create(name=item["name"], category_id=item["category"])
-            product_info = ProductInfo.objects.create(
-                                                      product_id=product.id,external_id=item["id"],
-                                                      model=item["model"], price=item["price"],
-                                                      price_rrc=item["price_rrc"],
-                                                      quantity=item["quantity"], shop_id=shop.id,
-                                                      )
-            for name, value in item["parameters"].items():
-                parameter_object, _ = Parameter.objects.get_or_create(name=name)
-                ProductParameter.objects.create(
-                                                product_info_id=product_info.id,
-                                                parameter_id=parameter_object.id,
-                                                value=value,
-                                                )
+        job = start_import_job(request.user, serializer.validated_data["url"],
+                               incremental=serializer.validated_data["incremental"])
         return Response(
-            {"status": "Success", "message": "Данные загружены"},
-            status=status.HTTP_200_OK,
+            {"status": "Success", "message": "Загрузка прайса поставлена в очередь", "job": job.id},
+            status=status.HTTP_202_ACCEPTED,
         )
 
 class PartnerUpdateFILE(APIView):
     permission_classes = [IsAuthenticated, UserIsShop]
+    serializer_class = PartnerUpdateFileSerializer
     """
     Класс для обновления прайса от поставщика из файла
     """
     def post(self, request, *args, **kwargs):
-        with open("./data/shop.yaml", "r", encoding="utf-8") as stream:
-            try:
-                data = yaml.safe_load(stream)
-            except yaml.YAMLError as exc:
-                print(exc)
-                return Response(
-                        {"status": "Failure", "error": "Ошибка загрузки файла"},
-                        status=status.HTTP_400_BAD_REQUEST,
-                    )
-
-        shop, _ = Shop.objects.get_or_create(name=data["shop"], user_id=request.user.id)
-
-        for category in data["categories"]:
-            category_object, _ = Category.objects.get_or_create(
-                id=category["id"], name=category["name"]
-            )
-            category_object.shops.add(shop.id)
-            category_object.save()
-
-        ProductInfo.objects.filter(shop_id=shop.id).delete()
-
-        for item in data["goods"]:
-            product, _ = Product.objects.get_or_create(name=item["name"], category_id=item["category"])
-            product_info = ProductInfo.objects.create(
-                                                      product_id=product.id,external_id=item["id"],
-                                                      model=item["model"], price=item["price"],
-                                                      price_rrc=item["price_rrc"],
-                                                      quantity=item["quantity"], shop_id=shop.id,
-                                                      )
-            for name, value in item["parameters"].items():
-                parameter_object, _ = Parameter.objects.get_or_create(name=name)
-                ProductParameter.objects.create(
-                                                product_info_id=product_info.id,
-                                                parameter_id=parameter_object.id,
-                                                value=value,
-                                                )
+        serializer = PartnerUpdateFileSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        job = start_import_job(request.user, f"./data/{serializer.validated_data['filename']}",
+                               incremental=serializer.validated_data["incremental"])
         return Response(
-            {"status": "Success", "message": "Данные загружены"},
-            status=status.HTTP_200_OK,
+            {"status": "Success", "message": "Загрузка прайса поставлена в очередь", "job": job.id},
+            status=status.HTTP_202_ACCEPTED,
         )
 
 
+class PartnerUpdateStatus(RetrieveAPIView):
+    """
+    Класс для получения статуса загрузки прайса
+    """
+    serializer_class = ImportJobSerializer
+    permission_classes = [IsAuthenticated, UserIsShop, UserIsOwner]
+
+    def get_queryset(self):
+        return ImportJob.objects.filter(user_id=self.request.user.id)
+
+
 class PartnerState(RetrieveUpdateAPIView):
     """
     Класс для работы со статусом поставщика
@@ -225,50 +183,121 @@ class PartnerState(RetrieveUpdateAPIView):
     permission_classes = [IsAuthenticated, UserIsShop, UserIsOwner]
  
     
-class CategoryView(ListAPIView):
+class CategoryView(CatalogCacheMixin, SparseFieldsMixin, ListAPIView):
     """
     Класс для просмотра категорий
     """
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
+    sparse_fields = ("id", "name")
 
 
-class ShopView(ListAPIView):
+class ShopView(CatalogCacheMixin, SparseFieldsMixin, ListAPIView):
     """
     Класс для просмотра списка магазинов
     """
     queryset = Shop.objects.filter(state=True)
     serializer_class = ShopSerializer
+    sparse_fields = ("id", "name", "state")
   
     
-class ProductInfoView(ListAPIView):
+class ProductInfoView(CatalogCacheMixin, ProductCardMixin, ListAPIView):
     """
     Класс для поиска товаров
     """
-    queryset = (
-        ProductInfo.objects.select_related("shop", "product__category")
-        .prefetch_related("product_parameters__parameter")
-        .distinct()
-    )
+    queryset = ProductInfo.objects.all()
     
     serializer_class = ProductInfoSerializer
+    pagination_class = ProductCursorPagination
     filter_backends = [DjangoFilterBackend]
     filterset_class = ProductFilter
+    stock_dependent = True
     
-class ProductInfoViewID(ModelViewSet):
+class ProductInfoViewID(ProductCardMixin, ModelViewSet):
     """
     Класс для поиска товаров
     """
-    queryset = (
-        ProductInfo.objects.select_related("shop", "product__category")
-        .prefetch_related("product_parameters__parameter")
-        .distinct()
-    )
+    queryset = ProductInfo.objects.all()
     
     serializer_class = ProductInfoSerializer
+    pagination_class = ProductCursorPagination
     filter_backends = [DjangoFilterBackend]
     filterset_class = ProductFilter
+    max_batch_size = 500
+
+    # список позиций по id: product/id/?ids=1,2,3
+    def list(self, request, *args, **kwargs):
+        ids = request.query_params.get("ids")
+        if ids is not None:
+            return self.batch(parse_ids(ids, self.max_batch_size))
+        return super().list(request, *args, **kwargs)
     
+class ProductFacetView(CatalogCacheMixin, GenericAPIView):
+    """
+    Класс для получения счетчиков значений параметров по выборке товаров
+    """
+    queryset = ProductInfo.objects.all()
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = ProductFilter
+
+    def get(self, request, *args, **kwargs):
+        return self.cached_response(request, self.get_facets)
+
+    def get_facets(self):
+        filterset = DjangoFilterBackend().get_filterset(self.request, self.get_queryset(), self)
+        if not filterset.is_valid():
+            raise ValidationError(filterset.errors)
+        data = filterset.form.cleaned_data
+        # магазин и категория задаются и короткими (shop_id), и полными (shop__id) именами
+        category = data.get("product__category_id")
+        shops = {value for value in (data.get("shop_id"), data.get("shop__id")) if value is not None}
+        categories = {value for value in (data.get("category_id"), category and category.id)
+                      if value is not None}
+        if data.get("search") or data.get("parameter") or len(shops) > 1 or len(categories) > 1:
+            return queryset_facets(filterset.qs)
+        # без поиска и отбора по параметрам достаточно предрассчитанных счетчиков
+        return precomputed_facets(next(iter(shops), None), next(iter(categories), None))
+
+
+class ProductOffersView(CatalogCacheMixin, GenericAPIView):
+    """
+    Класс для сравнения цен на продукты в магазинах, принимающих заказы.
+    Фильтры - как у списка товаров, а также ids (id продуктов через запятую),
+    top - число лучших предложений, after - id продукта, после которого выводить
+    """
+    queryset = available_offers()
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = ProductFilter
+    stock_dependent = True
+    max_top = 10
+
+    def get(self, request, *args, **kwargs):
+        return self.cached_response(request, self.get_offers)
+
+    def get_int(self, name, default=None):
+        value = self.request.query_params.get(name)
+        if value is None:
+            return default
+        try:
+            return int(value)
+        except ValueError:
+            raise ValidationError({"status": "Failure", "error": f"Параметр {name} должен быть числом"})
+
+    def get_offers(self):
+        offers = self.filter_queryset(self.get_queryset())
+        ids = self.request.query_params.get("ids")
+        if ids:
+            offers = offers.filter(product_id__in=parse_ids(ids))
+        top = min(max(self.get_int("top", 3), 1), self.max_top)
+        limit = settings.REST_FRAMEWORK["PAGE_SIZE"]
+        results, has_next = best_offers(offers, top=top, after=self.get_int("after"), limit=limit)
+        next_url = None
+        if has_next:
+            next_url = replace_query_param(self.request.build_absolute_uri(), "after",
+                                           results[-1]["id"])
+        return {"next": next_url, "results": results}
+
+
 class BasketView(APIView):
     """
     Класс для работы с корзиной пользователя
@@ -280,23 +309,26 @@ class BasketView(APIView):
 
     # получить корзину
     def get(self, request, *args, **kwargs):
-        basket = (Order.objects.filter(user=self.request.user, state="basket")
-                    .prefetch_related("ordered_items")
-                    .annotate(total_sum=Sum(F("ordered_items__quantity") * F("ordered_items__product_info__price"))
-                             ).first()
-                 )
-        serializer = OrderSerializer(basket)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        # итоги хранятся в заказе, агрегация не нужна
+        def build():
+            basket = (Order.objects.filter(user=self.request.user, state="basket")
+                        .prefetch_related("ordered_items").first()
+                     )
+            return OrderSerializer(basket).data
+
+        return Response(cached_basket(request.user.id, build), status=status.HTTP_200_OK)
 
     # добавить позиции в корзину
     def post(self, request, *args, **kwargs):
         serializer = OrderSerializer(data=request.data, context={"request": request})
-        if serializer.is_valid(raise_exception=True):
-            serializer.save()
-            return Response(
-                {"status": "Success", "message": "Товар добавлен в корзину"},
-                status=status.HTTP_200_OK,
-            )
+        # проверка наличия и запись позиций - в одной транзакции
+        with transaction.atomic():
+            if serializer.is_valid(raise_exception=True):
+                serializer.save()
+                return Response(
+                    {"status": "Success", "message": "Товар добавлен в корзину"},
+                    status=status.HTTP_200_OK,
+                )
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     # удалить товары из корзины
@@ -308,6 +340,7 @@ class BasketView(APIView):
                 status=status.HTTP_404_NOT_FOUND,
             )
         order.delete()
+        basket_changed(request.user.id)
         return Response(
             {"status": "Success", "message": "Товары удалены из корзины"},
             status=status.HTTP_200_OK,
@@ -316,30 +349,40 @@ class BasketView(APIView):
     # редактировать корзину
     def put(self, request, *args, **kwargs):
         serializer = OrderSerializer(data=request.data, context={"request": request})
-        if serializer.is_valid(raise_exception=True):
-            serializer.save()
-            return Response(
-                {"status": "Success", "message": "Товары в корзине изменены"},
-                status=status.HTTP_200_OK,
-            )
+        # проверка наличия и запись позиций - в одной транзакции
+        with transaction.atomic():
+            if serializer.is_valid(raise_exception=True):
+                serializer.save()
+                return Response(
+                    {"status": "Success", "message": "Товары в корзине изменены"},
+                    status=status.HTTP_200_OK,
+                )
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
 
-class OrderView(APIView):
+class OrderView(GenericAPIView):
     """
     Класс для получения заказов пользователями
     """
     permission_classes = [IsAuthenticated]
     serializer_class = OrderSerializer
-    
-    # получить мои заказы
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = OrderFilter
+    pagination_class = OrderCursorPagination
+
+    def get_queryset(self):
+        return Order.objects.filter(user_id=self.request.user.id).exclude(state='basket')
+
+    # получить мои заказы: страница по курсору, фильтры по статусу и дате
     def get(self, request, *args, **kwargs):
-        order = Order.objects.filter(user_id=request.user.id).exclude(state='basket').prefetch_related(
-            'ordered_items__product_info__product__category',
-            'ordered_items__product_info__product_parameters__parameter').select_related('contact').annotate(
-            total_sum=Sum(F('ordered_items__quantity') * F('ordered_items__product_info__price'))).distinct()
-        serializer = OrderSerializer(order, many=True)
-        return Response(serializer.data)
+        fields = parse_fields(request.query_params, ORDER_FIELDS)
+        # курсору нужна дата заказа, даже если поле dt не запрошено
+        columns = order_columns(fields)
+        if "dt" not in columns:
+            columns.append("dt")
+        # только чтение: страница выбирается одним запросом values, позиции - только для нее
+        page = self.paginate_queryset(self.filter_queryset(self.get_queryset()).values(*columns))
+        return self.get_paginated_response(render_orders(page, fields))
 
 
 class OrderViewConfirm(APIView):
@@ -353,18 +396,15 @@ class OrderViewConfirm(APIView):
     def post(self, request, *args, **kwargs):
         serializer = OrderConfirmationSerializer(data=request.data, context={"request": request})
         if serializer.is_valid(raise_exception=True):
-            basket = (Order.objects.filter(user=self.request.user, state="basket")
-                    .prefetch_related("ordered_items")
-                    .annotate(total_sum=Sum(F("ordered_items__quantity") * F("ordered_items__product_info__price"))
-                             ).first()
-                 )
-            response = OrderSerializer(basket)
             user = request.user
             order = serializer.validated_data
-            order.state = "new"
-            order.save()
+            try:
+                place_order(order, order.contact)
+            except ReservationError as error:
+                return Response({"status": "Failure", "error": str(error)},
+                                status=status.HTTP_400_BAD_REQUEST)
             new_order_created_mail(user)
-            new_order_notify(user, order, response.data["total_sum"])
+            new_order_notify(user, order, order.total_sum)
             return Response(
                 {"status": "Success", "message": "Спасибо за заказ"},
                 status=status.HTTP_200_OK,
@@ -372,6 +412,28 @@ class OrderViewConfirm(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
     
+class OrderViewCancel(APIView):
+    """
+    Класс для отмены заказов пользователями
+    """
+    # отменить заказ, зарезервированные товары возвращаются в наличие
+    permission_classes = [IsAuthenticated]
+    serializer_class = OrderCancelSerializer
+
+    def post(self, request, *args, **kwargs):
+        serializer = OrderCancelSerializer(data=request.data, context={"request": request})
+        serializer.is_valid(raise_exception=True)
+        try:
+            cancel_order(serializer.validated_data)
+        except ReservationError as error:
+            return Response({"status": "Failure", "error": str(error)},
+                            status=status.HTTP_400_BAD_REQUEST)
+        return Response(
+            {"status": "Success", "message": "Заказ отменен"},
+            status=status.HTTP_200_OK,
+        )
+
+
 class PartnerOrders(APIView):
     """
     Класс для получения заказов поставщиками
@@ -381,16 +443,11 @@ class PartnerOrders(APIView):
     serializer_class = OrderSerializer
 
     def get(self, request, *args, **kwargs):
-        order = Order.objects.filter(ordered_items__product_info__shop__user_id=request.user.id
-                            ).exclude(state='basket'
-                            ).prefetch_related(
-                                    'ordered_items__product_info__product__category',
-                                    'ordered_items__product_info__product_parameters__parameter'
-                            ).select_related('contact'
-                            ).annotate(total_sum=Sum(
-                                                     F('ordered_items__quantity') * 
-                                                     F('ordered_items__product_info__price')
-                                                     )
-                            ).distinct()
-        serializer = OrderSerializer(order, many=True)
-        return Response(serializer.data)
+        fields = parse_fields(request.query_params, ORDER_FIELDS)
+        # заказы с позициями магазина - по итогам магазина (одна строка на заказ, без distinct);
+        # сумма и количество - только по позициям этого магазина
+        order = Order.objects.filter(shop_totals__shop__user_id=request.user.id).exclude(state='basket')
+        return Response(build_orders(order.order_by('-dt', '-id'), fields, {
+            "total_sum": F("shop_totals__total_sum"),
+            "item_count": F("shop_totals__item_count"),
+        }))
@@ -0,0 +1,111 @@
+"""
+Генератор синтетических прайсов в формате data/shop.yaml (а также CSV и JSON Lines).
+
+    python -m benchmarks.generate --goods 100000 --categories 50 --parameters 20 -o shop.yaml
+    python -m benchmarks.generate --goods 100000 --format csv -o shop.csv
+"""
+import argparse
+import csv
+import json
+import random
+import sys
+
+COLORS = ("черный", "белый", "красный", "синий", "золотистый", "серебристый")
+
+
+def quote(value):
+    # строка JSON - корректная строка YAML в двойных кавычках
+    return json.dumps(value, ensure_ascii=False)
+
+
+def parameter_value(rnd, index):
+    if index % 3 == 0:
+        return rnd.choice(COLORS)
+    if index % 3 == 1:
+        return rnd.randint(1, 1024)
+    return round(rnd.uniform(1, 100), 1)
+
+
+def generate_goods(goods, categories, parameters, seed=0):
+    """Товары прайса: словари в том же виде, в каком их отдает разбор YAML"""
+    rnd = random.Random(seed)
+    names = [f"Параметр {index}" for index in range(1, parameters + 1)]
+    for external_id in range(1, goods + 1):
+        price = rnd.randint(100, 200000)
+        yield {
+            "id": external_id,
+            "category": rnd.randint(1, categories),
+            "model": f"model/{external_id % 1000}",
+            "name": f"Товар {external_id}",
+            "price": price,
+            "price_rrc": price + rnd.randint(0, 10000),
+            "quantity": rnd.randint(0, 100),
+            "parameters": {name: parameter_value(rnd, index) for index, name in enumerate(names)},
+        }
+
+
+def write_yaml(output, goods, categories, parameters, seed=0, shop="Benchmark"):
+    output.write(f"shop: {quote(shop)}\ncategories:\n")
+    for category_id in range(1, categories + 1):
+        output.write(f"  - id: {category_id}\n    name: {quote(f'Категория {category_id}')}\n")
+    output.write("goods:\n")
+    for item in generate_goods(goods, categories, parameters, seed):
+        output.write(
+            f"  - id: {item['id']}\n"
+            f"    category: {item['category']}\n"
+            f"    model: {quote(item['model'])}\n"
+            f"    name: {quote(item['name'])}\n"
+            f"    price: {item['price']}\n"
+            f"    price_rrc: {item['price_rrc']}\n"
+            f"    quantity: {item['quantity']}\n"
+            f"    parameters:\n"
+        )
+        for name, value in item["parameters"].items():
+            value = quote(value) if isinstance(value, str) else value
+            output.write(f"      {quote(name)}: {value}\n")
+
+
+def write_jsonl(output, goods, categories, parameters, seed=0, shop="Benchmark"):
+    header = {"shop": shop, "categories": [{"id": category_id, "name": f"Категория {category_id}"}
+                                           for category_id in range(1, categories + 1)]}
+    output.write(json.dumps(header, ensure_ascii=False) + "\n")
+    for item in generate_goods(goods, categories, parameters, seed):
+        output.write(json.dumps(item, ensure_ascii=False) + "\n")
+
+
+def write_csv(output, goods, categories, parameters, seed=0, shop="Benchmark"):
+    names = [f"Параметр {index}" for index in range(1, parameters + 1)]
+    writer = csv.writer(output)
+    writer.writerow(["shop", "category", "category_name", "id", "model", "name",
+                     "price", "price_rrc", "quantity", *names])
+    for item in generate_goods(goods, categories, parameters, seed):
+        writer.writerow([shop, item["category"], f"Категория {item['category']}", item["id"],
+                         item["model"], item["name"], item["price"], item["price_rrc"],
+                         item["quantity"], *(item["parameters"][name] for name in names)])
+        shop = ""
+
+
+WRITERS = {"yaml": write_yaml, "jsonl": write_jsonl, "csv": write_csv}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Генерация прайса для нагрузочного тестирования")
+    parser.add_argument("--goods", type=int, default=1000)
+    parser.add_argument("--categories", type=int, default=10)
+    parser.add_argument("--parameters", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--format", choices=WRITERS, default="yaml")
+    parser.add_argument("--shop", default="Benchmark", help="название магазина")
+    parser.add_argument("-o", "--output", default="-")
+    args = parser.parse_args(argv)
+
+    write = WRITERS[args.format]
+    if args.output == "-":
+        write(sys.stdout, args.goods, args.categories, args.parameters, args.seed, args.shop)
+        return
+    with open(args.output, "w", encoding="utf-8", newline="") as output:
+        write(output, args.goods, args.categories, args.parameters, args.seed, args.shop)
+
+
+if __name__ == "__main__":
+    main()
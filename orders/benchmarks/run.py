@@ -0,0 +1,132 @@
+"""
+Замер скорости загрузки прайса на SQLite и локальном PostgreSQL.
+
+    python -m benchmarks.run shop.yaml --database sqlite postgres --repeat 2 -o report.json
+
+Каждая база замеряется в отдельном процессе на временной (тестовой) БД.
+Отчет в формате JSON: время, число запросов, позиций в секунду и пиковая память
+по каждому прогону; повторные прогоны измеряют инкрементальную перезагрузку.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+DATABASES = {
+    "sqlite": {"PG_ENGINE": "django.db.backends.sqlite3", "PG_DB": ":memory:"},
+    "postgres": {"PG_ENGINE": "django.db.backends.postgresql"},
+}
+
+
+class QueryCounter:
+    """Счетчик запросов без сохранения их текста"""
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def peak_rss_kb():
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS отдает байты, Linux - килобайты
+    return usage // 1024 if sys.platform == "darwin" else usage
+
+
+def measure(path, repeat, incremental, batch_size):
+    """Прогон загрузки в текущем процессе, вызывается после настройки окружения"""
+    import django
+    django.setup()
+
+    from django.db import connection
+    from backend.importer import PriceListImporter
+    from backend.models import User
+    from backend.parsers import read_price_list
+
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        user = User.objects.create_user(email="benchmark@example.com", type="shop")
+        runs = []
+        for number in range(1, repeat + 1):
+            counter = QueryCounter()
+            importer = PriceListImporter(user_id=user.id, batch_size=batch_size,
+                                         incremental=incremental)
+            started = time.perf_counter()
+            with connection.execute_wrapper(counter), open(path, "rb") as stream:
+                summary = importer.run(read_price_list(stream, source=path))
+            wall_time = time.perf_counter() - started
+            runs.append({
+                "run": number,
+                "wall_time": round(wall_time, 4),
+                "queries": counter.count,
+                "rows": importer.processed,
+                "rows_per_sec": round(importer.processed / wall_time, 1) if wall_time else None,
+                "peak_rss_kb": peak_rss_kb(),
+                "summary": summary,
+            })
+        return {"database": connection.vendor, "runs": runs}
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_database(database, args):
+    env = dict(os.environ, DEBUG="", **DATABASES[database])
+    env.setdefault("DJANGO_SETTINGS_MODULE", "orders.settings")
+    command = [sys.executable, "-m", "benchmarks.run", args.path, "--single",
+               "--repeat", str(args.repeat), "--batch-size", str(args.batch_size)]
+    if args.full:
+        command.append("--full")
+    result = subprocess.run(command, env=env, capture_output=True, text=True)
+    if result.returncode:
+        return {"database": database, "error": result.stderr.strip().splitlines()[-1:]}
+    return json.loads(result.stdout)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Замер скорости загрузки прайса")
+    parser.add_argument("path", help="файл прайса (см. benchmarks.generate)")
+    parser.add_argument("--database", nargs="+", choices=DATABASES, default=["sqlite"])
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--full", action="store_true", help="полная перезагрузка вместо инкрементальной")
+    parser.add_argument("--single", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("-o", "--output", default="-")
+    args = parser.parse_args(argv)
+
+    if args.single:
+        result = measure(args.path, args.repeat, not args.full, args.batch_size)
+        json.dump(result, sys.stdout)
+        return
+
+    report = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "file": os.path.abspath(args.path),
+        "size_bytes": os.path.getsize(args.path),
+        "batch_size": args.batch_size,
+        "incremental": not args.full,
+        "results": [run_database(database, args) for database in args.database],
+    }
+    if args.output == "-":
+        json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+        sys.stdout.write("\n")
+        return
+    with open(args.output, "w", encoding="utf-8") as output:
+        json.dump(report, output, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
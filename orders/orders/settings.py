@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
 import os
+import tempfile
 import environ
 
 from pathlib import Path
@@ -99,6 +100,24 @@ DATABASES = {
 }
 
 
+# Cache
+# Кэш должен быть общим для всех процессов, включая обработчик загрузок (run_import_jobs):
+# в нем версии каталога, справочников и корзин. По умолчанию файловый (один хост),
+# в docker-compose - сервис redis (CACHE_URL в .env)
+
+CACHES = {
+    'default': env.cache_url(
+        "CACHE_URL", default=f"filecache://{os.path.join(tempfile.gettempdir(), 'orders_cache')}"
+    ),
+}
+
+# Время жизни закэшированных страниц каталога, секунд
+CATALOG_CACHE_TIMEOUT = int(os.environ.get("CATALOG_CACHE_TIMEOUT", 300))
+
+# Время жизни закэшированных корзин пользователей, секунд
+BASKET_CACHE_TIMEOUT = int(os.environ.get("BASKET_CACHE_TIMEOUT", 600))
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -154,6 +173,11 @@ SERVER_EMAIL = EMAIL_HOST_USER
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Число процессов обработчика заданий на загрузку прайсов (manage.py run_import_jobs)
+IMPORT_WORKERS = int(os.environ.get("IMPORT_WORKERS", 2))
+# Максимальный размер прайса в байтах
+IMPORT_MAX_SIZE = int(os.environ.get("IMPORT_MAX_SIZE", 512 * 1024 * 1024))
+
 REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 40,